@@ -6,9 +6,11 @@ print("Imported wizard101 pet games automator.")
 dgs = pg.DanceGameSolver()
 print("Ready to solve the dance game. Press 'E' or 'CTRL' to quit.")
 
+# 60 frames per second while playing, but only a few while waiting for the game, so it doesn't burn a whole core
 import keyboard
-while not keyboard.is_pressed('e') and not keyboard.is_pressed('ctrl'):
-    dgs.loop()
+scheduler = pg.DanceScheduler(dgs, tracking_fps=60, idle_fps=4)
+scheduler.run(should_stop=lambda: keyboard.is_pressed('e') or keyboard.is_pressed('ctrl'), report_interval=30)
+print(scheduler.report())
 
 # long quit
 import time
@@ -1,9 +1,17 @@
 print("Python is running! Hold on...")
 
-from wizard101 import bazaar
+from wizard101 import bazaar, util
 print("Imported wizard101 bazaar automator.")
 
-ab = bazaar.AutoBuyer(input("What are you looking for?\n> "))
+# several items can be watched for at once, i.e. "Mandrake Root, Black Lotus". The first one listed is bought first
+names = []
+while not names:
+    names = [name.strip() for name in input("What are you looking for? (separate items with commas)\n> ").split(",")]
+    names = [name for name in names if name]
+watchlist = [bazaar.AutoBuyer.Target(name, priority=-i) for i, name in enumerate(names)]
+
+# warp the cursor instead of gliding it, and click again as soon as the store reacts instead of after a fixed delay
+ab = bazaar.AutoBuyer(watchlist, timing=util.FAST_INPUT, confirm_input=True)
 print("Ready to autobuy. Hold 'E' or 'CTRL' to quit.")
 
 import keyboard
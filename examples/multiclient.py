@@ -0,0 +1,11 @@
+print("Python is running! Hold on...")
+
+from wizard101 import orchestrator, petgames
+print("Imported wizard101 orchestrator.")
+
+o = orchestrator.Orchestrator()
+solvers = o.add_all(lambda source: petgames.DanceGameSolver(source=source))
+print("Found %d game window(s). Press 'E' or 'CTRL' to quit." % len(solvers))
+
+import keyboard
+o.run(should_stop=lambda: keyboard.is_pressed('e') or keyboard.is_pressed('ctrl'))
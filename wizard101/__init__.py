@@ -0,0 +1,11 @@
+import importlib
+
+# submodules are only imported when they are first used, see `wizard101.central` for why
+__all__ = ["bazaar", "benchmark", "central", "instrumentation", "ocr", "orchestrator", "petgames", "util"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,45 +1,184 @@
 from wizard101 import util
+from wizard101.instrumentation import span, timed
+from wizard101.ocr import ImageCache, OcrEngine, TextMatcher, default_engine
 import time, cv2
 import numpy as np
 import PIL.Image, PIL.ImageFont, PIL.ImageDraw
-import pytesseract
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
+import os
 import re
-from threading import Thread
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields, replace
+from typing import Sequence
 
 
 class AutoBuyer:
     @dataclass
     class Resources:
-        reagents_tab: np.ndarray
-        snacks_tab: np.ndarray
+        reagents_tab: util.PreparedTemplate
+        snacks_tab: util.PreparedTemplate
 
-        banner: np.ndarray
-        selected_bazaar_tab: np.ndarray
-        next_page: np.ndarray
-        loading_banner: np.ndarray
-        ok: np.ndarray
+        banner: util.PreparedTemplate
+        selected_bazaar_tab: util.PreparedTemplate
+        next_page: util.PreparedTemplate
+        loading_banner: util.PreparedTemplate
+        ok: util.PreparedTemplate
 
         font: PIL.ImageFont.FreeTypeFont
 
-    def __init__(self, search: str):
+    @dataclass
+    class Layout:
+        """
+        Where things are in the store, in pixels relative to its top left corner, for a 1280x720 client.
+        """
+
+        store_offset: tuple[int, int] = (-430, 0)  # from the banner
+        store_size: tuple[int, int] = (740, 550)
+        name_list: tuple[int, int, int, int] = (246, 170, 250, 270)  # x, y, width, height
+        row_pitch: float = 27.0
+        row_text: tuple[int, int] = (3, 22)  # top and bottom of the text within a row
+        row_click_x: int = 371
+        sort_button: tuple[int, int] = (371, 157)
+        buy_button: tuple[int, int] = (195, 495)
+        quantity_slider: tuple[int, int, int, int] = (359, 349, 530, 349)  # drag from, drag to
+        confirm_button: tuple[int, int] = (270, 480)
+
+        def scaled(self, scale: float) -> "AutoBuyer.Layout":
+            changes = {}
+            for field in fields(self):
+                value = getattr(self, field.name)
+                if isinstance(value, tuple):
+                    changes[field.name] = tuple(round(v * scale) for v in value)
+                elif isinstance(value, int):
+                    changes[field.name] = round(value * scale)
+                else:
+                    changes[field.name] = value * scale
+
+            return replace(self, **changes)
+
+    @dataclass
+    class Target:
+        name: str
+        threshold: float = 70  # how similar (0-100) a row must be to this name to count as this item
+        priority: int = 0  # when several targets are listed at once, the highest priority is bought first
+
+        @property
+        def key(self) -> str:
+            return "".join(self.name.split()).lower()
+
+        @property
+        def sort_name(self) -> str:
+            return AutoBuyer.sortable(self.name)
+
+    @dataclass
+    class PageIndex:
+        """
+        Where names fell on the pages of the list in earlier sweeps, numbered front to back (A to Z).
+        Names are compared as `AutoBuyer.sortable` makes them, which sorts the same way the list does.
+        """
+
+        count: int | None = None  # the number of pages, once a sweep has reached the last one
+        bounds: dict[int, tuple[str, str]] = field(default_factory=dict)  # page -> its first and last name
+
+        def record(self, page: int, first: str, last: str) -> None:
+            self.bounds[page] = (first, last)
+
+        def finish(self, count: int) -> None:
+            if count != self.count:  # items were listed or sold, so pages past the end are gone
+                self.bounds = {page: names for page, names in self.bounds.items() if page < count}
+            self.count = count
+
+        def locate(self, name: str) -> tuple[int, int | None]:
+            """
+            The first and last page `name` could be on, going by the recorded pages. The last page is None if it
+            could be the last one, and how many pages there are isn't known yet.
+            """
+            low, high = 0, None if self.count is None else self.count - 1
+            for page, (first, last) in self.bounds.items():
+                if last < name:
+                    low = max(low, page + 1)
+                if name < first:
+                    high = page - 1 if high is None else min(high, page - 1)
+
+            return low, None if high is None else max(low, high)
+
+    def __init__(
+        self,
+        search: "str | AutoBuyer.Target | Sequence[str | AutoBuyer.Target]",
+        background_capture: bool = False,
+        source: util.FrameSource | None = None,
+        timing: util.InputTiming | None = None,
+        confirm_input: bool = False,
+        scale: float | None = None,
+        ocr_engine: OcrEngine | None = None,
+        glyphs: bool = True,
+        page_ocr: bool = False,
+    ):
+        """
+        `search` is the item to buy, or a watchlist of items (names or `AutoBuyer.Target`s with their own
+        thresholds and priorities). Every row of a page is scored against every item at once.
+
+        `scale` is the size of the game's UI relative to a 1280x720 client. By default it is detected from the
+        bazaar banner the first time the bazaar is found, and again whenever the banner can't be found anymore
+        (less and less often while it stays missing).
+
+        `ocr_engine` reads the item names, by default the fastest one installed (see `wizard101.ocr`).
+        With `glyphs`, rows are first matched against the searched name rendered in the game's font, and only
+        read with OCR when that isn't conclusive. With `page_ocr`, all the rows that still need OCR are read in one
+        call that finds every word on the page, and the words are sorted into rows by their position.
+        """
+        self.glyphs = glyphs
+        self.page_ocr = page_ocr
+        self.row_cache: ImageCache[list[str]] = ImageCache(maxsize=4096)  # what was read in each row image seen so far
+        # the name in each row image, to tell where a page is in the list
+        self.name_cache: ImageCache[str] = ImageCache(maxsize=4096)
+        self.page_index = AutoBuyer.PageIndex()
+        self.workers = ThreadPoolExecutor(max_workers=min(10, os.cpu_count() or 1), thread_name_prefix="bazaar")
+        self.ocr = ocr_engine or default_engine()
+        targets = [search] if isinstance(search, (str, AutoBuyer.Target)) else search
+        self.watchlist = [t if isinstance(t, AutoBuyer.Target) else AutoBuyer.Target(t) for t in targets]
+        if not self.watchlist:
+            raise ValueError("AutoBuyer needs at least one item to look for, but the watchlist is empty")
+        self.target_keys = [target.key for target in self.watchlist]
+        self.sort_names = {target.key: target.sort_name for target in self.watchlist}
+        self.raw_search = ", ".join(target.name for target in self.watchlist)
+        self.top_priority = max(target.priority for target in self.watchlist)
+        self.da = util.DesktopAutomator(source, timing)
+        self.confirm_input = confirm_input  # wait for the store to react to each click, instead of racing ahead
+        self.tracker = util.Tracker(self.da)
+        self.detect_scale = scale is None
+        self.scale_backoff = util.Backoff()  # detecting the scale is slow, so it's retried less and less often
+        self.set_scale(scale or 1.0)
+
+        self.background_capture = background_capture
+        self.state = ""
+
+    def set_scale(self, scale: float) -> None:
+        """
+        Switches to the templates and offsets for a UI that is `scale` times as large as a 1280x720 client.
+        Both are cached, so switching back and forth is cheap.
+        """
+        self.scale = scale
+        self.tracker.scale = scale
+        self.layout = AutoBuyer.Layout().scaled(scale)
         self.resources = AutoBuyer.Resources(
-            reagents_tab=util.img_resource("reagents_tab.png"),
-            snacks_tab=util.img_resource("snacks_tab.png"),
-            banner=util.img_resource("bazaar_banner.png"),
-            selected_bazaar_tab=util.img_resource("selected_bazaar_tab.png"),
-            next_page=util.img_resource("next_page.png"),
-            loading_banner=util.img_resource("loading_banner.png"),
-            ok=util.img_resource("ok.png"),
+            reagents_tab=util.template_resource("reagents_tab.png", scale),
+            snacks_tab=util.template_resource("snacks_tab.png", scale),
+            banner=util.template_resource("bazaar_banner.png", scale),
+            selected_bazaar_tab=util.template_resource("selected_bazaar_tab.png", scale),
+            next_page=util.template_resource("next_page.png", scale),
+            loading_banner=util.template_resource("loading_banner.png", scale),
+            ok=util.template_resource("ok.png", scale),
             font=util.font_resource("font.ttf", 48),
         )
 
-        self.da = util.DesktopAutomator()
-        self.state = ""
-        self.raw_search = search
-        self.search = "".join(search.split()).lower()
-        self.search_words = [self.generate_text(word.capitalize()) for word in search.split()]
+        # the names as the game draws them, so that most rows can be read without OCR
+        self.text_matcher = TextMatcher(
+            {
+                target.key: self.generate_text(" ".join(word.capitalize() for word in target.name.split()))
+                for target in self.watchlist
+            }
+        )
 
     def change_state(self, new_state: str) -> bool:
         if new_state == self.state:
@@ -50,9 +189,16 @@ class AutoBuyer:
             return True
 
     def generate_text(self, text: str) -> np.ndarray:
+        """
+        Renders `text` the way the store's item list draws it, as an RGBA image.
+        """
         left, top, right, bottom = self.resources.font.getbbox(text, anchor="lt")
         width, height = right - left, bottom - top
 
+        # letters are 13 pixels from the top of an ascender to the baseline, however far any descenders go
+        _, reference_top, _, reference_bottom = self.resources.font.getbbox("Bl", anchor="lt")
+        r = 13 * self.scale / (reference_bottom - reference_top)
+
         img = PIL.Image.new("RGBA", (width, height), (0, 0, 0, 0))
 
         drawer = PIL.ImageDraw.Draw(img)
@@ -61,58 +207,361 @@ class AutoBuyer:
         img = PIL.Image.fromarray(cv2.erode(np.array(img), np.ones((5, 5), np.uint8), iterations=1))
 
         img = img.resize((int(img.size[0] * 1.333), img.size[1]))
-        r = 13 / img.size[1]
         img = img.resize((int(img.size[0] * r), int(img.size[1] * r)))
 
         return np.array(img)
 
-    def rate_similarity(self, a: str, b: str) -> int:
-        return fuzz.ratio(a, b)
-
-    def threaded_determine_candidate(
-        self, index: int, text_image: np.ndarray, output: dict[int, dict[str, int | str]]
-    ) -> None:
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"[^a-z]", "", "".join(text.split()).lower())
+
+    @staticmethod
+    def sortable(text: str) -> str:
+        """
+        A name, lowercase with single spaces between words, which sorts the way the store lists it.
+        Unlike `normalize`, the spaces stay: "fire gem" is listed before "firecat".
+        """
+        return " ".join(re.sub(r"[^a-z\s]", "", text.lower()).split())
+
+    def determine_candidate(self, text_image: np.ndarray, ocr: bool = True) -> list[str] | None:
+        """
+        Reads one row of the item list: the names it might be, lowercase without spaces.
+        Without `ocr`, returns None for rows that can't be read without it.
+        Whatever name is read is also remembered for `read_name`.
+        """
+        row_image = text_image
         text_image = cv2.copyMakeBorder(
             text_image, top=5, bottom=5, left=5, right=5, borderType=cv2.BORDER_CONSTANT, value=(0, 0, 0, 0)
         )
-        candidates: list[str | None] = []
-
-        candidates.append(pytesseract.image_to_string(text_image))
-        text_image = cv2.erode(text_image, np.ones((1, 1), "uint8"))
-        candidates.append(pytesseract.image_to_string(text_image))
 
-        candidates = [re.sub(r"[^a-z]", "", "".join(c.split()).lower()) for c in candidates if c]
-        filtered_candidates = [c for c in candidates if c]
-        if filtered_candidates:
-            score, best_candidate = max(
-                (self.rate_similarity(candidate, self.search), candidate) for candidate in filtered_candidates
+        # most rows can be told apart by matching the rendered names, which is much faster than OCR
+        if self.glyphs:
+            with span("ocr:glyphs"):
+                text, similarity = self.text_matcher.match(text_image)
+            if similarity >= self.text_matcher.accept:
+                self.name_cache.put(ImageCache.key(row_image), self.sort_names[text])
+                return [text]
+            if similarity < self.text_matcher.reject:
+                return []
+
+        if not ocr:
+            return None
+
+        with span("ocr:row"):
+            text = self.ocr.image_to_string(text_image)
+        self.name_cache.put(ImageCache.key(row_image), self.sortable(text))
+        candidate = self.normalize(text)
+        return [candidate] if candidate else []
+
+    def read_rows(self, name_list_image: np.ndarray, rows: list[int]) -> dict[int, list[str]]:
+        """
+        Reads several rows of the item list with a single OCR call, and sorts the words it finds into rows
+        by where they are. Every other row is blanked out first, so that only these rows are read.
+        """
+        text_top, text_bottom = self.layout.row_text
+        page = np.zeros_like(name_list_image)
+        for i in rows:
+            y = int(i * self.layout.row_pitch)
+            page[y + text_top : y + text_bottom] = name_list_image[y + text_top : y + text_bottom]
+
+        border = 5
+        page = cv2.copyMakeBorder(
+            page, top=border, bottom=border, left=border, right=border, borderType=cv2.BORDER_CONSTANT, value=0
+        )
+        with span("ocr:words"):
+            words = self.ocr.image_to_data(page)
+
+        lines: dict[int, list[str]] = {i: [] for i in rows}
+        for word in sorted(words, key=lambda word: word.left):
+            row = int((word.top + word.height / 2 - border) // self.layout.row_pitch)
+            if row in lines:
+                lines[row].append(word.text)
+
+        for i, line in lines.items():
+            self.name_cache.put(ImageCache.key(self.row_image(name_list_image, i)), self.sortable(" ".join(line)))
+
+        texts = {i: self.normalize("".join(line)) for i, line in lines.items()}
+        return {i: [text] if text else [] for i, text in texts.items()}
+
+    def score_rows(self, row_candidates: dict[int, list[str]]) -> dict[int, dict]:
+        """
+        Scores what was read in each row against every item on the watchlist, in a single call.
+        Each row gets the target it matches best (`None` if it doesn't clear any target's threshold).
+        """
+        queries, owners = [], []
+        for index, candidates in row_candidates.items():
+            queries += candidates
+            owners += [index] * len(candidates)
+
+        found_items = {index: {"score": 0, "best_candidate": "unknown", "target": None} for index in row_candidates}
+        if not queries:
+            return found_items
+
+        scores = process.cdist(queries, self.target_keys, scorer=fuzz.ratio)  # (candidates, targets)
+
+        best: dict[int, tuple] = {}
+        for query, index in enumerate(owners):
+            for column, target in enumerate(self.watchlist):
+                score = float(scores[query, column])
+                qualifies = score >= target.threshold
+                # a target that clears its threshold beats any that doesn't, then priority wins, then similarity
+                rank = (qualifies, target.priority if qualifies else 0, score)
+                if index not in best or rank > best[index][0]:
+                    best[index] = (rank, queries[query], target if qualifies else None)
+
+        for index, ((_, _, score), candidate, target) in best.items():
+            found_items[index] = {"score": score, "best_candidate": candidate, "target": target}
+            match = f"{target.name!r}" if target else "nothing on the watchlist"
+            print(f"recognized {candidate!r} which is a {score:.0f}% match for {match}")
+
+        return found_items
+
+    def wait_in_store(
+        self,
+        template: util.PreparedTemplate,
+        store_rect: tuple[int, int, int, int],
+        visible: bool,
+        timeout: float,
+        max_difference: float = 0.01,
+    ) -> util.WaitResult:
+        """
+        Waits for `template` to show up (or go away), only watching the spot it was last seen if possible.
+        """
+        roi = self.tracker.roi(template)
+        if roi is not None:
+            result = self.da.wait_until(template, roi, visible, timeout=timeout, max_difference=max_difference)
+            if result.success:
+                return result
+
+            self.tracker.forget(template)  # the store probably moved, so watch all of it instead
+
+        result = self.da.wait_until(template, store_rect, visible, timeout=timeout, max_difference=max_difference)
+        if result.success and visible:
+            self.tracker.remember(template, result.x, result.y)
+
+        return result
+
+    def name_list(self, store_image: np.ndarray) -> np.ndarray:
+        """
+        The list of item names in the store, with everything but the (yellow and white) text blacked out.
+        """
+        x, y, w, h = self.layout.name_list
+        name_list_image = store_image[y : y + h, x : x + w]
+        name_list_threshold = cv2.inRange(
+            name_list_image,
+            (0, 200, 200, 0),  # type: ignore
+            (255, 255, 255, 255),  # type: ignore
+        )
+        return cv2.bitwise_and(name_list_image, name_list_image, mask=name_list_threshold)
+
+    def row_image(self, name_list_image: np.ndarray, index: int) -> np.ndarray:
+        text_top, text_bottom = self.layout.row_text
+        y = int(index * self.layout.row_pitch)
+        return name_list_image[y + text_top : y + text_bottom, :]
+
+    def read_name(self, text_image: np.ndarray) -> str:
+        """
+        Reads whatever name is in a row, as `sortable` makes it. Rows that `scan_page` already read with OCR (or
+        recognized by their rendered name) aren't read again.
+        """
+        key = ImageCache.key(text_image)
+        name = self.name_cache.get(key)
+        if name is None:
+            text_image = cv2.copyMakeBorder(
+                text_image, top=5, bottom=5, left=5, right=5, borderType=cv2.BORDER_CONSTANT, value=(0, 0, 0, 0)
             )
-            if best_candidate:
-                print(f"recognized {best_candidate!r} which is a {score:.0f}% match")
-                output[index] = {
-                    "score": score,
-                    "best_candidate": best_candidate,
-                }
-
-        output[index] = {
-            "score": 0,
-            "best_candidate": "unknown",
-        }
+            with span("ocr:name"):
+                name = self.sortable(self.ocr.image_to_string(text_image))
+            self.name_cache.put(key, name)
+
+        return name
+
+    def listed_rows(self, store_image: np.ndarray) -> list[np.ndarray]:
+        """
+        The rows of the item list on the current page that have a name in them. The last page can have empty rows.
+        """
+        name_list_image = self.name_list(store_image)
+        rows = [self.row_image(name_list_image, i) for i in range(10)]
+        return [row for row in rows if TextMatcher.text_width(row)]
+
+    def page_ends(self, rows: list[np.ndarray]) -> tuple[str, str] | None:
+        """
+        The names in the first and last of `rows`, in the order they are listed.
+        """
+        if not rows:
+            return None
+
+        first, last = self.workers.map(self.read_name, [rows[0], rows[-1]])
+        if not first or not last:
+            return None
+        return first, last
+
+    def plan_sweep(self) -> tuple[bool, int]:
+        """
+        Whether to go through the list back to front, and how many pages can be skipped without reading them,
+        going by where the watchlist's names were in earlier sweeps.
+        """
+        ranges = [self.page_index.locate(name) for name in self.sort_names.values()]
+        lowest = min(low for low, _ in ranges)
+        guess_backwards = all(name[0] > "m" for name in self.sort_names.values())  # from where they are in the alphabet
+
+        highs = [high for _, high in ranges if high is not None]
+        if self.page_index.count is None or len(highs) < len(ranges):
+            # how far each item is from the back isn't known, so only skip pages going front to back
+            return (True, 0) if guess_backwards else (False, lowest)
+
+        last_page = self.page_index.count - 1
+        highest = max(highs)
+        forwards_pages = highest  # pages to go through until every item's page has been seen
+        backwards_pages = last_page - lowest
+        if forwards_pages == backwards_pages:
+            backwards = guess_backwards
+        else:
+            backwards = backwards_pages < forwards_pages
+
+        return (True, last_page - highest) if backwards else (False, lowest)
+
+    def passed(self, rows: list[np.ndarray], ends: tuple[str, str], backwards: bool) -> bool:
+        """
+        Whether every item on the watchlist would have been listed by the end of this page (in the given
+        direction), so that the rest of the list doesn't need to be looked at.
+
+        A single misread name would end the sweep before an item that is for sale, so the last two rows have to
+        agree. The second to last is only read once the last one says the sweep is over.
+        """
+        first, last = ends
+        if len(rows) < 2 or (first > last) != backwards:
+            return False  # OCR misread one of them, so don't trust either
+
+        for name in [last, self.read_name(rows[-2])]:
+            if backwards and not all(target > name for target in self.sort_names.values()):
+                return False
+            if not backwards and not all(target < name for target in self.sort_names.values()):
+                return False
+
+        return True
+
+    def click_next_page(self, store_image: np.ndarray, store_x: int, store_y: int, confirm: bool = False) -> bool:
+        """
+        Goes to the next page of the list, if there is one. With `confirm`, waits until the list has changed.
+        """
+        next_x, next_y, next_match_diff = self.da.find_in_image(store_image, self.resources.next_page)
+        if next_match_diff > 0.01:
+            return False
 
+        h, w, *_ = self.resources.next_page.shape
+        list_rect = self.name_list_rect(store_x, store_y)
+        self.da.click(store_x + next_x + w // 2, store_y + next_y + h // 2, confirm=list_rect if confirm else None)
+        return True
+
+    def name_list_rect(self, store_x: int, store_y: int) -> tuple[int, int, int, int]:
+        x, y, list_width, list_height = self.layout.name_list
+        return store_x + x, store_y + y, list_width, list_height
+
+    def decisive(self, item: dict) -> bool:
+        """
+        Whether nothing else on the page could be worth buying instead of this row.
+        """
+        return item["target"] is not None and item["target"].priority == self.top_priority
+
+    @timed("ocr:page")
+    def scan_page(self, store_image: np.ndarray, stop_early: bool = False) -> dict[int, dict]:
+        """
+        Reads every row of the item list on the current page of the store, and scores it against the watchlist.
+
+        Rows are read by a pool of workers, the ones most likely to be on the watchlist first, and scored as soon as
+        they are read. With `stop_early`, this returns as soon as a row matches one of the highest priority
+        targets, without the rows that weren't read yet.
+        """
+        name_list_image = self.name_list(store_image)
+
+        cached_rows: dict[int, list[str]] = {}
+        new_rows: dict[bytes, list[int]] = {}  # rows that haven't been read before, by their pixels
+        row_images: dict[int, np.ndarray] = {}
+        for i in range(10):
+            text_image = self.row_image(name_list_image, i)
+
+            key = ImageCache.key(text_image)
+            cached = self.row_cache.get(key)
+            if cached is not None:
+                cached_rows[i] = cached
+                continue
+            if key in new_rows:  # i.e. several empty rows on the last page
+                new_rows[key].append(i)
+                continue
+            new_rows[key] = [i]
+            row_images[i] = text_image
+
+        found_items = self.score_rows(cached_rows)
+        if stop_early and any(self.decisive(item) for item in found_items.values()):
+            return found_items
+
+        keys = {rows[0]: key for key, rows in new_rows.items()}
+        order = sorted(row_images, key=lambda i: -self.text_matcher.likelihood(row_images[i]))
+        futures = {self.workers.submit(self.determine_candidate, row_images[i], not self.page_ocr): i for i in order}
+
+        unread = []
+        for future in as_completed(futures):
+            first = futures[future]
+            candidates = future.result()
+            if candidates is None:
+                unread.append(first)
+                continue
+
+            self.row_cache.put(keys[first], candidates)
+            scored = self.score_rows({i: candidates for i in new_rows[keys[first]]})
+            found_items.update(scored)
+            if stop_early and self.decisive(scored[first]):
+                for pending in futures:
+                    pending.cancel()
+                return found_items
+
+        if unread:
+            read = self.read_rows(name_list_image, unread)
+            for first, candidates in read.items():
+                self.row_cache.put(keys[first], candidates)
+            found_items.update(self.score_rows({i: read[first] for first in read for i in new_rows[keys[first]]}))
+
+        return found_items
+
+    @timed("loop:bazaar")
     def loop(self) -> None:
-        fullscreen_image = self.da.grab_fullscreen()
-        banner_x, banner_y, banner_match_diff = self.da.find_in_image(fullscreen_image, self.resources.banner)
+        # the bazaar window rarely moves, so this usually only looks at a small region around the last banner
+        banner_x, banner_y, banner_match_diff = self.tracker.locate(self.resources.banner)
+
+        if banner_match_diff > 0.01 and self.detect_scale and self.scale_backoff.ready():
+            # maybe the client was resized. This searches the whole desktop at several scales, which takes up to
+            # seconds, so it's only retried a while after the last search finished
+            scale, banner_x, banner_y, banner_match_diff = self.da.detect_scale(
+                util.template_resource("bazaar_banner.png")
+            )
+            if banner_match_diff > 0.01:
+                self.scale_backoff.failed()
+            else:
+                if scale != self.scale:
+                    print(f"The game's UI is drawn at {scale:.2f}x")
+                    self.set_scale(scale)
+                self.tracker.remember(self.resources.banner, banner_x, banner_y)
 
         if banner_match_diff > 0.01:
             self.change_state("Please open the bazaar")
             return
         else:
+            self.scale_backoff.succeeded()
             self.change_state("Bazaar located!")
 
-        store_x, store_y = banner_x - 430, banner_y
-        store_width, store_height = 740, 550
+        layout = self.layout
+        store_x, store_y = banner_x + layout.store_offset[0], banner_y + layout.store_offset[1]
+        store_width, store_height = layout.store_size
         store_rect = (store_x, store_y, store_width, store_height)
-        store_image = fullscreen_image[store_y : store_y + store_height, store_x : store_x + store_width]
+        store_region = {"left": store_x, "top": store_y, "width": store_width, "height": store_height}
+        if self.background_capture:  # keep the store captured while we are busy matching and reading it
+            if not self.da.capturing:
+                self.da.start_capture(store_region, fps=30)
+            elif self.da.capture_region != store_region:
+                self.da.set_capture_region(store_region)
+
+        store_image = self.da.latest(*store_rect)
 
         tab_height, tab_width, *_ = self.resources.selected_bazaar_tab.shape
         tab_x, tab_y, tab_match_diff = self.da.find_in_image(store_image, self.resources.selected_bazaar_tab)
@@ -124,73 +573,85 @@ class AutoBuyer:
 
         # refresh the page
         self.change_state("Refreshing list...")
-        self.da.click(store_x + tab_x + tab_width // 2, store_y + tab_y + tab_height // 2)
-
-        # wait for it to load
-        loading_banner_diff = 0
-        while loading_banner_diff < 0.01:
-            time.sleep(0.5)
-            store_image = self.da.grab(*store_rect)
-            _, _, loading_banner_diff = self.da.find_in_image(store_image, self.resources.loading_banner)
+        # the list is cleared (or covered by the loading banner) as soon as the click lands, so wait for that instead
+        # of for the banner, which might not show up at all if the list loads quickly enough
+        list_rect = self.name_list_rect(store_x, store_y)
+        self.da.click(store_x + tab_x + tab_width // 2, store_y + tab_y + tab_height // 2, confirm=list_rect)
+
+        # then wait for it to load
+        loaded = self.wait_in_store(self.resources.loading_banner, store_rect, visible=False, timeout=10)
+        if not loaded.success:
+            self.change_state("The list never finished loading")
+            return
+        print(f"list loaded after {loaded.elapsed * 1000:.0f} ms")
 
         self.change_state(f"Looking for {self.raw_search!r}...")
 
-        if self.search[0] > "m":
+        backwards, skip = self.plan_sweep()
+        if backwards:
             # better off sorting back to front
-            self.da.click(store_x + 371, store_y + 157)
+            self.da.click(store_x + layout.sort_button[0], store_y + layout.sort_button[1], confirm=store_rect)
+
+        page = 0  # how many pages into the list (in the direction it's sorted)
+        for _ in range(skip):
+            # these pages were already seen to end before any item on the watchlist would be listed
+            if not self.click_next_page(self.da.latest(*store_rect), store_x, store_y, confirm=True):
+                break
+            page += 1
+        if page:
+            print(f"skipped {page} pages")
 
         while True:
-            store_image = self.da.grab(*store_rect)
-            name_list_image = store_image[170:440, 246:496]
-            name_list_threshold = cv2.inRange(
-                name_list_image,
-                (0, 200, 200, 0),  # type: ignore
-                (255, 255, 255, 255),  # type: ignore
-            )
-            name_list_image = cv2.bitwise_and(name_list_image, name_list_image, mask=name_list_threshold)
-
-            found_items = {}
-            threads = []
-            for i in range(10):
-                y = i * 27
-                text_image = name_list_image[y + 3 : y + 22, :]
-                t = Thread(target=self.threaded_determine_candidate, args=(i, text_image, found_items))
-                t.start()
-                threads.append(t)
-
-            for t in threads:
-                t.join()
-
-            best_score, best_index = None, None
-            for i, item in found_items.items():
-                if best_score is None or item["score"] > best_score:
-                    best_score, best_index = item["score"], i
-
-            assert best_index is not None and best_score is not None
-
-            if best_score > 70:
-                self.change_state("Found it! Puchasing...")
-                self.da.click(store_x + 371, store_y + 170 + int(27 * (best_index + 0.5)))
-                self.da.click(store_x + 195, store_y + 495)
-                self.da.drag(store_x + 359, store_y + 349, store_x + 530, store_y + 349)
-                self.da.click(store_x + 270, store_y + 480)
-
-                ok_x, ok_y, ok_diff = 0, 0, 1
-                while ok_diff > 0.05:
-                    print(ok_x, ok_y, ok_diff)
-                    time.sleep(0.5)
-                    store_image = self.da.grab(*store_rect)
-                    ok_x, ok_y, ok_diff = self.da.find_in_image(store_image, self.resources.ok)
+            store_image = self.da.latest(*store_rect)
+            found_items = self.scan_page(store_image, stop_early=True)
+
+            hits = [(item["target"].priority, item["score"], i) for i, item in found_items.items() if item["target"]]
+
+            if hits:
+                _, _, best_index = max(hits)
+                self.change_state(f"Found {found_items[best_index]['target'].name!r}! Puchasing...")
+                confirm = store_rect if self.confirm_input else None
+                row_y = layout.name_list[1] + int(layout.row_pitch * (best_index + 0.5))
+                self.da.click(store_x + layout.row_click_x, store_y + row_y, confirm=confirm)
+                self.da.click(store_x + layout.buy_button[0], store_y + layout.buy_button[1], confirm=confirm)
+                from_x, from_y, to_x, to_y = layout.quantity_slider
+                self.da.drag(store_x + from_x, store_y + from_y, store_x + to_x, store_y + to_y, confirm=confirm)
+                self.da.click(store_x + layout.confirm_button[0], store_y + layout.confirm_button[1])
+
+                ok = self.wait_in_store(self.resources.ok, store_rect, visible=True, timeout=10, max_difference=0.05)
+                if not ok.success:
+                    self.change_state("The purchase never finished")
+                    return
+                print(f"purchase went through after {ok.elapsed * 1000:.0f} ms")
 
                 ok_height, ok_width, *_ = self.resources.ok.shape
-                self.da.click(store_x + ok_x + ok_width // 2, store_y + ok_y + ok_height // 2)
+                self.da.click(ok.x + ok_width // 2, ok.y + ok_height // 2)
                 self.change_state("Purchased!")
                 time.sleep(1)
                 break
             else:
-                next_x, next_y, next_match_diff = self.da.find_in_image(store_image, self.resources.next_page)
-                if next_match_diff > 0.01:
+                rows = self.listed_rows(store_image)
+                ends = self.page_ends(rows)
+                if ends is not None:
+                    first = ends[0]
+                    skipped_too_far = any(
+                        name > first if backwards else name < first for name in self.sort_names.values()
+                    )
+                    if skip and page == skip and skipped_too_far:
+                        print("skipped past where an item would be listed, so no pages will be skipped next time")
+                        self.page_index.bounds.clear()
+
+                    count = self.page_index.count
+                    if not backwards:
+                        self.page_index.record(page, *ends)
+                    elif count is not None:
+                        self.page_index.record(count - 1 - page, ends[1], ends[0])
+
+                if ends is not None and self.passed(rows, ends, backwards):
+                    print(f"every item would have been listed by page {page + 1}, so none are for sale")
                     break
 
-                h, w, *_ = self.resources.next_page.shape
-                self.da.click(store_x + next_x + h // 2, store_y + next_y + w // 2)
+                if not self.click_next_page(store_image, store_x, store_y, confirm=self.confirm_input):
+                    self.page_index.finish(page + 1)
+                    break
+                page += 1
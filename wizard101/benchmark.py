@@ -0,0 +1,374 @@
+"""
+Benchmarks for the vision hot path: template matching, the dance game solver and the bazaar page scan.
+Also times how long importing the package takes, since most of it is supposed to be imported lazily.
+
+    python -m wizard101.benchmark                         # run everything and print a table
+    python -m wizard101.benchmark --save baseline.json    # ...and remember the results
+    python -m wizard101.benchmark --compare baseline.json # ...and fail if anything got slower
+    python -m wizard101.benchmark --recording session.npz # run the dance solver against a recorded session
+    python -m wizard101.benchmark --spans                 # also break the time down by stage (see `instrumentation`)
+
+Everything runs against the bundled templates and synthetic (or recorded) screens, so no game is needed.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable
+
+import cv2
+import numpy as np
+import PIL.Image, PIL.ImageDraw
+
+from wizard101 import util
+from wizard101.instrumentation import instrumentation
+
+
+@dataclass
+class Result:
+    name: str
+    iterations: int
+    ops_per_sec: float
+    p50_ms: float
+    p99_ms: float
+
+
+def measure(name: str, func: Callable[[], object], min_time: float = 1.0, min_iterations: int = 5) -> Result:
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()  # warm up caches (i.e. the downscaled templates and the classifier's spectra)
+
+    samples = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the solvers like to print what they are doing
+        while len(samples) < min_iterations or time.perf_counter() - started < min_time:
+            before = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - before)
+
+    samples_ms = np.array(samples) * 1000
+    return Result(
+        name=name,
+        iterations=len(samples),
+        ops_per_sec=len(samples) / sum(samples),
+        p50_ms=float(np.percentile(samples_ms, 50)),
+        p99_ms=float(np.percentile(samples_ms, 99)),
+    )
+
+
+class MemoryFrameSource(util.ReplayFrameSource):
+    """
+    Replays a list of frames that are already in memory, starting over once it runs out.
+    """
+
+    def __init__(self, frames: list[np.ndarray], fps: float = 30):
+        self.frames = frames
+        super().__init__([i / fps for i in range(len(frames))])
+
+    def load(self, index: int) -> np.ndarray:
+        return self.frames[index]
+
+    def step(self) -> bool:
+        if not super().step():
+            self.index = 0
+        return True
+
+
+def synthetic_desktop(width: int, height: int, seed: int = 0) -> np.ndarray:
+    # smooth noise, so that templates don't match equally well everywhere
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(1, height // 8), max(1, width // 8), 4), dtype=np.uint8)
+    desktop = cv2.resize(small, (width, height))
+    desktop[:, :, 3] = 255
+    return desktop
+
+
+def paste(image: np.ndarray, template: util.PreparedTemplate, x: int, y: int) -> None:
+    alpha = template.image[:, :, 3:] / 255.0 if template.has_alpha else 1.0
+    region = image[y : y + template.height, x : x + template.width, :3]
+    region[:] = template.image[:, :, :3] * alpha + region * (1 - alpha)
+
+
+def find_in_image_cases(da: util.DesktopAutomator) -> list[tuple[str, Callable[[], object]]]:
+    cases = []
+    sizes = {"roi": None, "1080p": (1920, 1080), "4k": (3840, 2160)}
+    templates = {"alpha": "dance_empty.png", "opaque": "ok.png"}
+
+    for size_name, size in sizes.items():
+        for template_name, resource in templates.items():
+            template = util.template_resource(resource)
+
+            # the roi is the template plus some padding, like the dance game solver grabs
+            width, height = size or (template.width + 20, template.height + 20)
+            haystack = synthetic_desktop(width, height)
+            paste(haystack, template, (width - template.width) // 2, (height - template.height) // 2)
+            float_haystack = np.float32(haystack) / 255
+            float_template = util.PreparedTemplate(np.float32(template.image) / 255, name=resource)
+
+            pyramids = [1] if size_name == "roi" else [1, 4]
+            for pyramid in pyramids:
+                mode = "" if pyramid == 1 else f",pyramid={pyramid}"
+                cases.append(
+                    (
+                        f"find_in_image[{size_name},{template_name},uint8{mode}]",
+                        lambda h=haystack, t=template, p=pyramid: da.find_in_image(h, t, pyramid=p),
+                    )
+                )
+                cases.append(
+                    (
+                        f"find_in_image[{size_name},{template_name},float32{mode}]",
+                        lambda h=float_haystack, t=float_template, p=pyramid: da.find_in_image(h, t, pyramid=p),
+                    )
+                )
+
+            # a raw array has to be prepared on every call
+            cases.append(
+                (
+                    f"find_in_image[{size_name},{template_name},unprepared]",
+                    lambda h=haystack, t=template.image: da.find_in_image(h, t),
+                )
+            )
+
+    return cases
+
+
+def dance_frames() -> list[np.ndarray]:
+    frames = []
+    for name in ["empty", "up", "up", "empty", "left", "left", "empty", "down", "down", "empty", "empty"]:
+        frame = synthetic_desktop(1280, 720)
+        paste(frame, util.template_resource(f"dance_{name}.png"), 600, 300)
+        frames.append(frame)
+    return frames
+
+
+def dance_cases(recording: str | None) -> list[tuple[str, Callable[[], object]]]:
+    from wizard101 import petgames
+
+    if recording is None:
+        source, label = MemoryFrameSource(dance_frames()), "synthetic"
+    elif pathlib.Path(recording).is_dir():
+        source, label = util.DirectoryFrameSource(recording), "recorded"
+    else:
+        source, label = util.RecordedFrameSource(recording), "recorded"
+
+    solver = petgames.DanceGameSolver(source=source)
+    solver.time_state_changed = -10  # search for the window immediately
+
+    def step() -> None:
+        solver.loop()
+        if not source.step():
+            source.index = 0
+
+    # nothing on the screen changes, i.e. waiting for the next arrow
+    idle_frame = dance_frames()[0]
+    idle_solver = petgames.DanceGameSolver(source=MemoryFrameSource([idle_frame]))
+    idle_solver.time_state_changed = -10
+
+    roi = synthetic_desktop(81, 81)
+    paste(roi, solver.resources.up, 10, 10)
+
+    return [
+        ("DanceGameSolver()", lambda: petgames.DanceGameSolver(source=MemoryFrameSource([idle_frame]))),
+        (f"DanceGameSolver.loop[{label}]", step),
+        ("DanceGameSolver.loop[idle]", idle_solver.loop),
+        ("TemplateClassifier.classify[roi]", lambda: solver.classifier.classify(roi)),
+        ("SignatureClassifier.classify[roi]", lambda: solver.signatures.classify(roi, 10, 10)),
+    ]
+
+
+def bazaar_page(names: list[str], render: Callable[[str], np.ndarray] | None = None) -> np.ndarray:
+    store = synthetic_desktop(740, 550)
+    store[170:440, 246:496, :3] //= 4  # the list is dark, so that only the names pass the threshold
+
+    if render is not None:  # i.e. `AutoBuyer.generate_text`
+        for i, name in enumerate(names[:10]):
+            text = render(name)
+            height, width = text.shape[0], min(text.shape[1], 240)
+            alpha = text[:, :width, 3:] / 255.0
+            region = store[170 + i * 27 + 5 : 170 + i * 27 + 5 + height, 250 : 250 + width, :3]
+            region[:] = text[:, :width, :3] * alpha + region * (1 - alpha)  # drawn the same way as below
+        return store
+
+    image = PIL.Image.fromarray(store)
+    drawer = PIL.ImageDraw.Draw(image)
+    font = util.font_resource("font.ttf", 14)
+    for i, name in enumerate(names[:10]):
+        drawer.text((250, 170 + i * 27 + 5), name, (0, 255, 255, 255), font=font)
+
+    return np.array(image)
+
+
+def bazaar_engines() -> list:
+    from wizard101 import ocr
+
+    engines: list[ocr.OcrEngine] = []
+    if shutil.which("tesseract") is not None:
+        engines.append(ocr.PytesseractEngine())
+    try:
+        engines.append(ocr.TesserocrEngine())
+    except ImportError:
+        pass
+
+    return engines
+
+
+def check_prefix_names(source: util.FrameSource) -> None:
+    """
+    A name that only starts with the searched one (i.e. "Mist Wood Plank" when looking for "Mist Wood") must not be
+    recognized as it from the rendered names alone, or the wrong item gets bought.
+    """
+    from wizard101 import bazaar
+
+    buyer = bazaar.AutoBuyer("Mist Wood", source=source, scale=1.0)
+    store = bazaar_page(["Mist Wood Plank", "Mist Wood"], render=buyer.generate_text)
+    name_list_image = buyer.name_list(store)
+    for row, expected in [(0, False), (1, True)]:
+        text_image = cv2.copyMakeBorder(buyer.row_image(name_list_image, row), 5, 5, 5, 5, cv2.BORDER_CONSTANT)
+        text, similarity = buyer.text_matcher.match(text_image)
+        accepted = similarity >= buyer.text_matcher.accept
+        assert accepted == expected, f"row {row} matched {text!r} with a similarity of {similarity:.3f}"
+
+
+def bazaar_cases() -> list[tuple[str, Callable[[], object]]]:
+    from wizard101 import bazaar
+
+    names = [
+        "Amber",
+        "Black Lotus",
+        "Blood Moss",
+        "Cattail",
+        "Deep Mushroom",
+        "Frost Flower",
+        "Mandrake Root",
+        "Mist Wood",
+        "Pearl",
+        "Sandstone",
+    ]
+    source = MemoryFrameSource([synthetic_desktop(1280, 720)])
+    check_prefix_names(source)
+
+    def uncached(buyer: "bazaar.AutoBuyer", page: np.ndarray) -> Callable[[], object]:
+        return lambda: (buyer.row_cache.clear(), buyer.scan_page(page))
+
+    # every row is told apart by its rendered name, so no OCR is needed
+    glyph_buyer = bazaar.AutoBuyer("Mandrake Root", source=source, scale=1.0)
+    glyph_page = bazaar_page(names, render=glyph_buyer.generate_text)
+    cases = [
+        ("AutoBuyer.scan_page[10 rows,glyphs]", uncached(glyph_buyer, glyph_page)),
+        ("AutoBuyer.scan_page[10 rows,cached]", lambda: glyph_buyer.scan_page(glyph_page)),
+        (
+            "AutoBuyer.scan_page[10 rows,glyphs,stop early]",
+            lambda: (glyph_buyer.row_cache.clear(), glyph_buyer.scan_page(glyph_page, stop_early=True)),
+        ),
+    ]
+
+    # the same page, scored against several items at once
+    watchlist = ["Mandrake Root", "Black Lotus", "Frost Flower", "Mist Wood", "Fire Gem"]
+    watchlist_buyer = bazaar.AutoBuyer(watchlist, source=source, scale=1.0)
+    cases.append(
+        (f"AutoBuyer.scan_page[10 rows,glyphs,{len(watchlist)} targets]", uncached(watchlist_buyer, glyph_page))
+    )
+
+    engines = bazaar_engines()
+    if not engines:
+        print("neither tesseract nor tesserocr is installed, skipping the OCR benchmarks", file=sys.stderr)
+
+    page = bazaar_page(names)
+    for engine in engines:
+        buyer = bazaar.AutoBuyer("Sunstone", source=source, scale=1.0, ocr_engine=engine, glyphs=False)
+        cases.append((f"AutoBuyer.scan_page[10 rows,{engine.name}]", uncached(buyer, page)))
+        buyer = bazaar.AutoBuyer("Sunstone", source=source, scale=1.0, ocr_engine=engine, glyphs=False, page_ocr=True)
+        cases.append((f"AutoBuyer.scan_page[10 rows,{engine.name},page]", uncached(buyer, page)))
+    return cases
+
+
+def import_cases() -> list[tuple[str, Callable[[], object]]]:
+    # every import runs in a fresh interpreter, so this includes the interpreter's own startup time
+    root = str(pathlib.Path(__file__).parent.parent)
+    cases = []
+    for module in ["wizard101", "wizard101.central", "wizard101.central.database", "wizard101.util"]:
+        command = [sys.executable, "-c", f"import {module}"]
+        cases.append((f"import[{module}]", lambda c=command: subprocess.run(c, check=True, cwd=root)))
+    return cases
+
+
+def run(recording: str | None = None, only: str | None = None, min_time: float = 1.0) -> list[Result]:
+    da = util.DesktopAutomator(MemoryFrameSource([synthetic_desktop(1280, 720)]))
+    cases = import_cases() + find_in_image_cases(da) + dance_cases(recording) + bazaar_cases()
+
+    results = []
+    for name, func in cases:
+        if only and only not in name:
+            continue
+
+        result = measure(name, func, min_time=min_time)
+        print(
+            f"{result.name:<55} {result.ops_per_sec:>10.1f} ops/s"
+            f" p50 {result.p50_ms:>9.3f} ms  p99 {result.p99_ms:>9.3f} ms",
+            flush=True,
+        )
+        results.append(result)
+
+    return results
+
+
+def compare(results: list[Result], baseline_path: str, tolerance: float = 0.15) -> list[str]:
+    """
+    Returns a description of every benchmark whose p50 latency is more than `tolerance` slower than the baseline.
+    """
+    baseline = {r["name"]: r for r in json.loads(pathlib.Path(baseline_path).read_text())}
+
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+
+        before = baseline[result.name]["p50_ms"]
+        change = result.p50_ms / before - 1 if before else 0
+        print(f"{result.name:<55} {before:>9.3f} ms -> {result.p50_ms:>9.3f} ms ({change:+.0%})")
+        if change > tolerance:
+            regressions.append(f"{result.name} is {change:.0%} slower ({before:.3f} ms -> {result.p50_ms:.3f} ms)")
+
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", help="a recorded session (.npz) or a directory of PNG frames")
+    parser.add_argument("--only", help="only run benchmarks whose name contains this")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds to spend on each benchmark")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results previously written with --save")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 slowdown when comparing")
+    parser.add_argument("--spans", action="store_true", help="print how long each stage took, over all benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.spans:
+        instrumentation.enable()
+    results = run(recording=args.recording, only=args.only, min_time=args.min_time)
+    if args.spans:
+        print()
+        instrumentation.print_summary(file=sys.stdout)
+
+    if args.save:
+        pathlib.Path(args.save).write_text(json.dumps([asdict(r) for r in results], indent=2))
+
+    if args.compare:
+        print()
+        regressions = compare(results, args.compare, tolerance=args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
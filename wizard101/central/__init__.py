@@ -1 +1,12 @@
-from . import database, remote, processor, constants
+import importlib
+
+# submodules are only imported when they are first used, so that i.e. querying the database
+# doesn't also import selenium and BeautifulSoup for the scraper
+__all__ = ["constants", "database", "processor", "remote"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
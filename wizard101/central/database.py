@@ -7,7 +7,9 @@ I slowly added features to this file and eventually ended up with a copy of SQLA
 but I am now too lazy to refactor it to _actually_ use SQLAlchemy. Oh well.
 """
 
+import pathlib
 import re
+import sqlite3
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from types import UnionType
@@ -24,7 +26,6 @@ from typing import (
     get_type_hints,
 )
 
-from .. import util
 from .constants import *
 
 
@@ -183,7 +184,7 @@ class DatabasePersistable:
     def raw_fetch(
         cls: Type[InheritsDatabasePersistable], sql: str, parameters: Iterable[Any] = ()
     ) -> Generator[InheritsDatabasePersistable, None, None]:
-        for row in _active_cursors[-1].execute(sql, tuple(parameters)):
+        for row in active_cursor().execute(sql, tuple(parameters)):
             assert len(row) == len(
                 cls._columns.all
             ), f"Your query selects {len(row)} columns, but this class contains {len(cls._columns.all)} columns. You must `SELECT` exactly the right number of columns."
@@ -303,11 +304,11 @@ class DatabasePersistable:
         ON CONFLICT({cls.pk}) DO UPDATE SET {", ".join(f"{col.name} = ?" for col in cls._columns.all)}
         """
 
-        _active_cursors[-1].execute(sql, self.get_ordered_column_values() * 2)
+        active_cursor().execute(sql, self.get_ordered_column_values() * 2)
 
     def delete(self):
         cls = self.__class__
-        _active_cursors[-1].execute(f"DELETE FROM {cls.table_name} WHERE {cls.pk} = ?", (getattr(self, cls.pk),))
+        active_cursor().execute(f"DELETE FROM {cls.table_name} WHERE {cls.pk} = ?", (getattr(self, cls.pk),))
 
 
 def truthy_repr(cls):
@@ -429,8 +430,38 @@ class Jewel(DatabasePersistable):
     pet_ability_page_url: str | None = None
 
 
-connection = util.database_resource("central.sqlite")
+_connection: sqlite3.Connection | None = None
+_active_cursors: list[sqlite3.Cursor] = []
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    The database is only opened once something actually needs it, not when this module is imported.
+    """
+    global _connection
+    if _connection is None:
+        # not `util.database_resource`, since importing `util` would pull in the whole vision stack
+        _connection = sqlite3.connect(str(pathlib.Path(__file__).parent.parent / "resource" / "central.sqlite"))
+
+    return _connection
+
+
+def active_cursor() -> sqlite3.Cursor:
+    if not _active_cursors:
+        _active_cursors.append(get_connection().cursor())
+
+    return _active_cursors[-1]
+
+
+def __getattr__(name: str) -> Any:
+    if name == "connection":  # `database.connection` used to be opened on import
+        return get_connection()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
+    connection = get_connection()
     connection.executescript(  # for now, dropping derivative tables on every run
         f"""
         {RawSiteData.get_table_structure()};
@@ -455,15 +486,13 @@ if __name__ == "__main__":
     connection.commit()
 
 
-_active_cursors = [connection.cursor()]
-
-
 @contextmanager
 def cursor(commit=True):
-    cur = connection.cursor()
+    active_cursor()  # make sure the default cursor exists underneath this one
+    cur = get_connection().cursor()
     _active_cursors.append(cur)
     yield cur
     _active_cursors.pop()
 
     if commit:
-        connection.commit()
+        get_connection().commit()
@@ -6,7 +6,6 @@ import sys
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-import undetected_chromedriver as uc
 
 from . import database as db
 from .constants import *
@@ -14,6 +13,8 @@ from .constants import *
 
 @cache
 def driver() -> webdriver.Chrome:
+    import undetected_chromedriver as uc  # slow to import, and only needed once something is actually fetched
+
     return uc.Chrome()
 
 
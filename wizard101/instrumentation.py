@@ -0,0 +1,226 @@
+"""
+Low overhead timing of named stages (spans), i.e. `capture`, `match:ok.png`, `ocr:row`, `input:click`, `wait:*`.
+
+    from wizard101.instrumentation import instrumentation
+    instrumentation.enable()                  # nothing is recorded until this is called
+    instrumentation.print_summary_on_exit()   # or `instrumentation.dump_json("spans.json")`
+
+Setting the `WIZARD101_INSTRUMENT` environment variable does the same thing without changing any code.
+It can be `1` (print a summary on exit), a path ending in `.json` (dump the spans there on exit),
+or `cprofile` (also run cProfile, and print its hottest functions on exit).
+"""
+
+import atexit
+import cProfile
+import json
+import math
+import os
+import pstats
+import sys
+import threading
+import functools
+import time
+from typing import Callable
+
+
+class Histogram:
+    """
+    Durations bucketed on a log scale (4 buckets per doubling, starting at 1 microsecond), so recording is O(1)
+    and percentiles are accurate to about 20%.
+    """
+
+    buckets_per_doubling = 4
+    smallest = 1e-6
+
+    def __init__(self):
+        self.counts: list[int] = []
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def bucket(self, seconds: float) -> int:
+        if seconds <= self.smallest:
+            return 0
+        return int(math.log2(seconds / self.smallest) * self.buckets_per_doubling) + 1
+
+    def upper_bound(self, bucket: int) -> float:
+        return self.smallest * 2 ** (bucket / self.buckets_per_doubling)
+
+    def record(self, seconds: float) -> None:
+        bucket = self.bucket(seconds)
+        if bucket >= len(self.counts):
+            self.counts.extend([0] * (bucket + 1 - len(self.counts)))
+
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+
+        target = p / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.upper_bound(bucket), self.max)
+
+        return self.max
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "min_ms": self.min * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p90_ms": self.percentile(90) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Span:
+    __slots__ = ("owner", "name", "started")
+
+    def __init__(self, owner: "Instrumentation", name: str):
+        self.owner = owner
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> "Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.owner.record(self.name, self.started, time.perf_counter())
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+null_span = NullSpan()
+
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.histograms: dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+
+        # called with (name, started, ended) after every span, i.e. to annotate a sampling profiler's timeline
+        self.hooks: list[Callable[[str, float, float], None]] = []
+        self.profiler: cProfile.Profile | None = None
+
+    def enable(self, profile: bool = False) -> None:
+        """
+        Starts recording spans. With `profile=True`, cProfile also runs until `disable` is called.
+        """
+        self.enabled = True
+        if profile and self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms.clear()
+
+    def span(self, name: str) -> Span | NullSpan:
+        """
+        `with instrumentation.span("capture"): ...` records how long the block took, if enabled.
+        """
+        if not self.enabled:
+            return null_span
+        return Span(self, name)
+
+    def record(self, name: str, started: float, ended: float) -> None:
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].record(ended - started)
+
+        for hook in self.hooks:
+            hook(name, started, ended)
+
+    def to_dict(self) -> dict[str, dict[str, float]]:
+        with self.lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def dump_json(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self) -> str:
+        lines = [f"{'span':<40} {'count':>8} {'total ms':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name, stats in sorted(self.to_dict().items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(
+                f"{name:<40} {stats['count']:>8} {stats['total_ms']:>10.1f} {stats['p50_ms']:>9.3f}"
+                f" {stats['p99_ms']:>9.3f} {stats['max_ms']:>9.3f}"
+            )
+        return "\n".join(lines)
+
+    def print_summary(self, file=None) -> None:
+        file = file or sys.stderr
+        print(self.summary(), file=file)
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            print(file=file)
+            pstats.Stats(self.profiler, stream=file).sort_stats("cumulative").print_stats(25)
+
+    def print_summary_on_exit(self) -> None:
+        atexit.register(self.print_summary)
+
+    def dump_json_on_exit(self, path: str) -> None:
+        atexit.register(self.dump_json, path)
+
+
+instrumentation = Instrumentation()
+span = instrumentation.span
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator that records every call of the function as the span `name`.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def configure_from_environment() -> None:
+    setting = os.environ.get("WIZARD101_INSTRUMENT", "").strip()
+    if not setting or setting == "0":
+        return
+
+    instrumentation.enable(profile=setting.lower() == "cprofile")
+    if setting.lower().endswith(".json"):
+        instrumentation.dump_json_on_exit(setting)
+    else:
+        instrumentation.print_summary_on_exit()
+
+
+configure_from_environment()
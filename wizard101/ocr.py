@@ -0,0 +1,290 @@
+"""
+Text recognition backends. `default_engine()` picks the fastest one that is installed:
+
+- `TesserocrEngine` keeps a pool of Tesseract instances loaded in this process (needs `pip install tesserocr`),
+  and hands them images in memory.
+- `PytesseractEngine` runs the `tesseract` executable once per call, writing the image to a temporary file.
+  This works anywhere Tesseract is installed, but spawning the process is most of the cost of a call.
+"""
+
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+import cv2
+import numpy as np
+import PIL.Image
+
+
+@dataclass
+class Word:
+    text: str
+    left: int
+    top: int
+    width: int
+    height: int
+    confidence: float  # 0-100
+
+
+class OcrEngine:
+    """
+    Recognizes text in BGRA (or grayscale) images. Safe to use from several threads at once.
+    """
+
+    name = ""
+
+    def image_to_string(self, image: np.ndarray) -> str:
+        raise NotImplementedError
+
+    def image_to_data(self, image: np.ndarray) -> list[Word]:
+        """
+        Every word in the image along with where it is, so that a single call can read many lines at once.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractEngine(OcrEngine):
+    name = "pytesseract"
+
+    def __init__(self, config: str = ""):
+        import pytesseract
+
+        self.pytesseract = pytesseract
+        self.config = config
+
+    def image_to_string(self, image: np.ndarray) -> str:
+        return self.pytesseract.image_to_string(image, config=self.config)
+
+    def image_to_data(self, image: np.ndarray) -> list[Word]:
+        data = self.pytesseract.image_to_data(image, config=self.config, output_type=self.pytesseract.Output.DICT)
+        return [
+            Word(text.strip(), left, top, width, height, float(confidence))
+            for text, left, top, width, height, confidence in zip(
+                data["text"], data["left"], data["top"], data["width"], data["height"], data["conf"]
+            )
+            if text.strip()  # the rows describing blocks, paragraphs and lines have no text
+        ]
+
+
+class TesserocrEngine(OcrEngine):
+    """
+    Up to `size` Tesseract instances that stay loaded (models and all) for as long as the engine lives.
+    Each call borrows one, so up to `size` images are recognized in parallel.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, size: int | None = None, lang: str = "eng", psm: int | None = None):
+        import tesserocr
+
+        self.tesserocr = tesserocr
+        self.size = size or min(8, os.cpu_count() or 1)
+        self.lang = lang
+        self.psm = tesserocr.PSM.AUTO if psm is None else psm
+
+        self.idle: queue.LifoQueue = queue.LifoQueue()  # the most recently used instance is the warmest
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                try:
+                    return self.tesserocr.PyTessBaseAPI(lang=self.lang, psm=self.psm)
+                except BaseException:
+                    self.created -= 1  # or once `size` instances failed to start, every call would wait forever
+                    raise
+
+        return self.idle.get()
+
+    def image_to_string(self, image: np.ndarray) -> str:
+        api = self.acquire()
+        try:
+            # the same conversion pytesseract does, so both engines see the same image
+            api.SetImage(PIL.Image.fromarray(image))
+            return api.GetUTF8Text()
+        finally:
+            self.idle.put(api)
+
+    def image_to_data(self, image: np.ndarray) -> list[Word]:
+        level = self.tesserocr.RIL.WORD
+        api = self.acquire()
+        try:
+            api.SetImage(PIL.Image.fromarray(image))
+            api.Recognize()
+            iterator = api.GetIterator()
+            if iterator is None:
+                return []
+
+            words = []
+            for result in self.tesserocr.iterate_level(iterator, level):
+                text = (result.GetUTF8Text(level) or "").strip()
+                box = result.BoundingBox(level)
+                if text and box:
+                    left, top, right, bottom = box
+                    words.append(Word(text, left, top, right - left, bottom - top, result.Confidence(level)))
+            return words
+        finally:
+            self.idle.put(api)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().End()
+            except queue.Empty:
+                break
+
+
+class TextMatcher:
+    """
+    Recognizes a few known strings in a line of text by matching images of them, rendered in the game's own font,
+    against it. This is much faster than OCR and can't misread a single letter, but only knows the given strings.
+
+    A line that matches a string with a similarity (normalized correlation) of at least `accept` contains it, and
+    one that matches every string worse than `reject` contains none of them. Anything in between is up to OCR.
+    A line whose text is more than `width_tolerance` pixels wider or narrower than the string is less similar to it
+    the more they differ, so that a longer name which merely starts with the string isn't mistaken for it.
+    """
+
+    def __init__(
+        self,
+        rendered: dict[str, np.ndarray],
+        accept: float = 0.9,
+        reject: float = 0.4,
+        threshold: int = 200,
+        width_tolerance: int = 4,
+    ):
+        # rendered text is anti-aliased, but lines to match have been thresholded, so threshold the text the same way
+        self.templates = {text: np.float32(self.intensity(image) >= threshold) for text, image in rendered.items()}
+        self.widths = [self.text_width(template) for template in self.templates.values()]
+        self.accept = accept
+        self.reject = reject
+        self.width_tolerance = width_tolerance
+
+    @staticmethod
+    def intensity(image: np.ndarray) -> np.ndarray:
+        # rendered text and thresholded screenshots are both transparent (or black) wherever there is no text
+        if image.ndim == 3:
+            image = image[:, :, 3] if image.shape[-1] == 4 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return np.float32(image)
+
+    @classmethod
+    def text_width(cls, image: np.ndarray) -> int:
+        columns = np.flatnonzero(cls.intensity(image).any(axis=0))
+        return int(columns[-1] - columns[0] + 1) if len(columns) else 0
+
+    def likelihood(self, line: np.ndarray) -> float:
+        """
+        A very cheap guess at how likely `line` is to contain one of the known strings, from how close the width
+        of its text is to theirs: 1 if it is exactly as wide as one of them, 0 if it has no text at all.
+        """
+        width = self.text_width(line)
+        if not width:
+            return 0.0
+        return max((1 - abs(width - known) / max(width, known) for known in self.widths if known), default=0.0)
+
+    def match(self, line: np.ndarray) -> tuple[str, float]:
+        """
+        Returns the known string that best matches `line`, and how similar they are (1 is identical).
+        """
+        line = np.float32(self.intensity(line) > 0)
+        line_width = self.text_width(line)
+        if not line_width:
+            return "", 0.0
+
+        best_text, best_similarity = "", 0.0
+        for text, template in self.templates.items():
+            # text that runs past the end of the line is cut off in the game as well
+            template = template[: line.shape[0], : line.shape[1]]
+            if not template.any():
+                continue
+
+            similarity = np.nan_to_num(cv2.matchTemplate(line, template, cv2.TM_CCOEFF_NORMED)).max()
+
+            # matching only finds where the string is in the line, not whether the line has more text after it
+            width = self.text_width(template)
+            if abs(line_width - width) > self.width_tolerance:
+                similarity *= min(line_width, width) / max(line_width, width)
+            if similarity > best_similarity:
+                best_text, best_similarity = text, float(similarity)
+
+        return best_text, best_similarity
+
+
+T = TypeVar("T")
+
+
+class ImageCache(Generic[T]):
+    """
+    Remembers what was recognized in the last `maxsize` distinct images, keyed by a hash of their pixels,
+    so that an image that was already read (i.e. an unchanged row of the store) doesn't have to be read again.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[bytes, T] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image: np.ndarray) -> bytes:
+        digest = hashlib.blake2b(str(image.shape).encode(), digest_size=16)
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.digest()
+
+    def get(self, key: bytes) -> T | None:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: bytes, value: T) -> None:
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+_default_engine: OcrEngine | None = None
+_default_engine_lock = threading.Lock()
+
+
+def default_engine() -> OcrEngine:
+    """
+    One engine shared by the whole process: `TesserocrEngine` if tesserocr is installed and can load its models,
+    otherwise `PytesseractEngine`.
+    """
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            try:
+                engine = TesserocrEngine()
+                engine.idle.put(engine.acquire())  # i.e. fails if tesserocr can't find its tessdata
+                _default_engine = engine
+            except (ImportError, RuntimeError):
+                _default_engine = PytesseractEngine()
+
+        return _default_engine
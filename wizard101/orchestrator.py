@@ -0,0 +1,283 @@
+"""
+Runs several game clients on one machine at the same time, i.e. one `AutoBuyer` or `DanceGameSolver` per window.
+
+    orchestrator = Orchestrator()
+    orchestrator.add_all(lambda source: petgames.DanceGameSolver(source=source))
+    orchestrator.run(should_stop=lambda: keyboard.is_pressed("e"))
+
+The area covering every window is captured once per tick, and each client crops its own window out of that frame
+instead of grabbing the screen itself. Each client only ever sees its own window, so it never searches (or clicks)
+anywhere else. Mouse and keyboard input is handed out one client at a time, in the order it was asked for, and the
+window receiving it is brought to the front first.
+"""
+
+import contextlib
+import functools
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, Protocol
+
+import numpy as np
+
+from wizard101 import util
+from wizard101.instrumentation import span
+
+
+@dataclass
+class GameWindow:
+    region: dict[str, int]  # the client area (without the title bar), in desktop coordinates
+    title: str = ""
+    handle: int | None = None  # the native window handle, when known
+
+
+class Client(Protocol):
+    da: util.DesktopAutomator
+
+    def loop(self) -> None: ...
+
+
+def find_game_windows(title: str = "Wizard101") -> list[GameWindow]:
+    """
+    Every visible window with this title. Only implemented on Windows, where the game runs; returns [] elsewhere.
+    """
+    if sys.platform != "win32":
+        return []
+
+    import ctypes
+    import ctypes.wintypes
+
+    user32 = ctypes.windll.user32  # type: ignore
+    windows = []
+
+    @ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.wintypes.HWND, ctypes.wintypes.LPARAM)  # type: ignore
+    def visit(handle, _):
+        if not user32.IsWindowVisible(handle):
+            return True
+
+        length = user32.GetWindowTextLengthW(handle)
+        text = ctypes.create_unicode_buffer(length + 1)
+        user32.GetWindowTextW(handle, text, length + 1)
+        if text.value != title:
+            return True
+
+        # mss grabs physical pixels, and so do these calls since mss makes the process DPI aware
+        rect, origin = ctypes.wintypes.RECT(), ctypes.wintypes.POINT(0, 0)
+        user32.GetClientRect(handle, ctypes.byref(rect))
+        user32.ClientToScreen(handle, ctypes.byref(origin))
+        if rect.right > 0 and rect.bottom > 0:  # minimized windows have an empty client area
+            region = {"left": origin.x, "top": origin.y, "width": rect.right, "height": rect.bottom}
+            windows.append(GameWindow(region, text.value, handle))
+        return True
+
+    user32.EnumWindows(visit, 0)
+    return sorted(windows, key=lambda window: (window.region["left"], window.region["top"]))
+
+
+def bounding_box(regions: list[dict[str, int]]) -> dict[str, int]:
+    left = min(region["left"] for region in regions)
+    top = min(region["top"] for region in regions)
+    right = max(region["left"] + region["width"] for region in regions)
+    bottom = max(region["top"] + region["height"] for region in regions)
+    return {"left": left, "top": top, "width": right - left, "height": bottom - top}
+
+
+class SharedFrameSource(util.FrameSource):
+    """
+    Serves grabs by cropping the frame captured by the last `tick`, as long as it is at most `max_age` seconds old
+    and covers the requested area. Anything else is grabbed from `source` directly. Safe to use from any thread.
+    `wait_for_tick` blocks until a new frame has been captured, so that readers don't spin on the same one.
+    """
+
+    def __init__(self, source: util.FrameSource | None = None, max_age: float = 0.25):
+        self.source = source or util.MssFrameSource()
+        self.monitors = self.source.monitors
+        self.interactive = self.source.interactive
+        self.max_age = max_age
+
+        self.region: dict[str, int] = self.monitors[0]
+        self.frame: util.Frame | None = None
+        self.ticks = 0
+        self.misses = 0  # grabs that could not be served from the shared frame
+
+        self.local = threading.local()
+        self.thread_sources: list[util.FrameSource] = []
+        self.lock = threading.Lock()
+        self.ticked = threading.Condition()
+
+    def thread_source(self) -> util.FrameSource:
+        if not hasattr(self.local, "source"):
+            self.local.source = self.source.for_thread()
+            with self.lock:
+                self.thread_sources.append(self.local.source)
+
+        return self.local.source
+
+    def tick(self) -> util.Frame:
+        """
+        Captures `region` for every grab that follows.
+        """
+        region = dict(self.region)
+        timestamp = time.time()
+        with span("capture:shared"):
+            image = self.thread_source().grab(region)
+
+        frame = util.Frame(image=image, timestamp=timestamp, sequence=self.ticks, region=region)
+        with self.ticked:
+            self.frame = frame
+            self.ticks += 1
+            self.ticked.notify_all()
+        return frame
+
+    def wait_for_tick(self, ticks: int, timeout: float | None = None) -> int:
+        """
+        Waits until more than `ticks` frames have been captured (or `timeout` seconds have passed),
+        and returns how many have been.
+        """
+        with self.ticked:
+            self.ticked.wait_for(lambda: self.ticks > ticks, timeout=timeout)
+            return self.ticks
+
+    def grab(self, region: dict[str, int]) -> np.ndarray:
+        x, y, w, h = (int(region[key]) for key in ("left", "top", "width", "height"))
+        frame = self.frame
+        if frame is not None and time.time() - frame.timestamp <= self.max_age and frame.contains(x, y, w, h):
+            return frame.crop(x, y, w, h)
+
+        self.misses += 1
+        return self.thread_source().grab(region)
+
+    def close(self) -> None:
+        with self.lock:
+            for source in self.thread_sources:
+                if source is not self.source:
+                    source.close()
+            self.thread_sources.clear()
+
+
+class ClientFrameSource(util.FrameSource):
+    """
+    One client's view of a `SharedFrameSource`: its only monitor is its own window, so searches stay inside it.
+    """
+
+    def __init__(self, shared: SharedFrameSource, window: GameWindow):
+        self.shared = shared
+        self.window = window
+        self.monitors = [dict(window.region), dict(window.region)]
+        self.interactive = shared.interactive
+
+    def grab(self, region: dict[str, int]) -> np.ndarray:
+        return self.shared.grab(region)
+
+
+class InputScheduler:
+    """
+    Lets one client at a time use the mouse and keyboard, first come first served, so their clicks and key presses
+    never interleave. The window receiving input is brought to the front whenever that changes.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+        self.focused: GameWindow | None = None
+
+    @contextlib.contextmanager
+    def turn(self, window: GameWindow) -> Iterator[None]:
+        with span("input:queued"), self.condition:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.condition.wait_for(lambda: self.serving == ticket)
+
+        try:
+            if self.focused is not window:
+                self.focus(window)
+                self.focused = window
+            yield
+        finally:
+            with self.condition:
+                self.serving += 1
+                self.condition.notify_all()
+
+    def focus(self, window: GameWindow) -> None:
+        # without a handle, the click itself has to focus the window (which also works for mouse input)
+        if window.handle is not None and sys.platform == "win32":
+            import ctypes
+
+            ctypes.windll.user32.SetForegroundWindow(window.handle)  # type: ignore
+            time.sleep(0.05)  # give the window a moment to actually receive focus
+
+
+class Orchestrator:
+    def __init__(self, source: util.FrameSource | None = None, fps: float = 30, max_age: float = 0.25):
+        self.shared = SharedFrameSource(source, max_age=max_age)
+        self.scheduler = InputScheduler()
+        self.capture_interval = 1 / fps
+        self.clients: list[tuple[GameWindow, Client]] = []
+        self.threads: list[threading.Thread] = []
+        self.running = False
+
+    def add(self, window: GameWindow, make_client: Callable[[util.FrameSource], Client]) -> Client:
+        """
+        Creates a client for `window`. `make_client` gets the `FrameSource` the client's automator has to use.
+        """
+        client = make_client(ClientFrameSource(self.shared, window))
+        client.da.input_turn = functools.partial(self.scheduler.turn, window)
+
+        self.clients.append((window, client))
+        self.shared.region = bounding_box([window.region for window, _ in self.clients])
+        return client
+
+    def add_all(self, make_client: Callable[[util.FrameSource], Client], title: str = "Wizard101") -> list[Client]:
+        """
+        Creates a client for every game window that is open right now.
+        """
+        return [self.add(window, make_client) for window in find_game_windows(title)]
+
+    def capture_forever(self) -> None:
+        next_capture = time.time()
+        while self.running:
+            self.shared.tick()
+
+            # keep a steady rate, but don't try to catch up on frames that were missed
+            next_capture = max(next_capture + self.capture_interval, time.time())
+            time.sleep(max(0, next_capture - time.time()))
+
+    def run_client(self, client: Client) -> None:
+        while self.running:
+            ticks = self.shared.ticks
+            client.loop()
+
+            # until the next tick the client would only see the same frame again, so there is nothing new to do
+            with span("client:idle"):
+                self.shared.wait_for_tick(ticks, timeout=self.capture_interval * 2)
+
+    def start(self) -> None:
+        if self.running:
+            return
+
+        self.running = True
+        self.shared.tick()  # so that no client starts before there is a frame to share
+        self.threads = [threading.Thread(target=self.capture_forever, daemon=True)]
+        self.threads += [threading.Thread(target=self.run_client, args=(c,), daemon=True) for _, c in self.clients]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.shared.close()
+
+    def run(self, should_stop: Callable[[], bool] = lambda: False, poll_interval: float = 0.1) -> None:
+        """
+        Runs every client on its own thread until `should_stop` returns True.
+        """
+        self.start()
+        try:
+            while not should_stop():
+                time.sleep(poll_interval)
+        finally:
+            self.stop()
@@ -1,34 +1,47 @@
 from wizard101 import util
-import time, keyboard
-import numpy as np
+from wizard101.instrumentation import Histogram, timed
+import time
 from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
 
 
 class DanceGameSolver:
     @dataclass
     class Resources:
-        down: np.ndarray
-        right: np.ndarray
-        up: np.ndarray
-        left: np.ndarray
-        empty: np.ndarray
+        down: util.PreparedTemplate
+        right: util.PreparedTemplate
+        up: util.PreparedTemplate
+        left: util.PreparedTemplate
+        empty: util.PreparedTemplate
 
-    def __init__(self):
-        self.resources = DanceGameSolver.Resources(
-            down=util.img_resource("dance_down.png"),
-            right=util.img_resource("dance_right.png"),
-            up=util.img_resource("dance_up.png"),
-            left=util.img_resource("dance_left.png"),
-            empty=util.img_resource("dance_empty.png"),
-        )
+    def __init__(
+        self,
+        background_capture: bool = False,
+        source: util.FrameSource | None = None,
+        scale: float | None = None,
+        signatures: bool = True,
+    ):
+        """
+        `scale` is the size of the game's UI relative to a 1280x720 client. By default it is detected whenever
+        the game window has to be searched for.
 
-        self.maxTemplateSize = [0, 0]  # x, y
-        for img in self.resources.__dict__.values():
-            self.maxTemplateSize[0] = max(self.maxTemplateSize[0], img.shape[1])
-            self.maxTemplateSize[1] = max(self.maxTemplateSize[1], img.shape[0])
+        With `signatures`, frames are first classified by a `SignatureClassifier` at the spot the last arrow was
+        found, and only matched against every template when it isn't confident.
+        """
+        self.use_signatures = signatures
+        self.da = util.DesktopAutomator(source)
+        self.tracker = util.Tracker(self.da)
+        self.detect_scale = scale is None
+        self.scale_backoff = util.Backoff()  # detecting the scale is slow, so it's retried less and less often
+        self.set_scale(scale or 1.0)
 
         self.known_location = [xy / 2.0 for xy in self.maxTemplateSize]  # x, y CENTER!!
-        self.da = util.DesktopAutomator()
+        self.background_capture = background_capture
+        self.last_sequence = -1
+        self.last_version = None
+        self.last_classification: tuple[str, int, int, float] | None = None
 
         self.state = None
         self.last_state = None
@@ -36,25 +49,83 @@ class DanceGameSolver:
         self.printed_not_found = False
 
         self.sequence = None
+        self.sequence_seen: list[float] = []  # when the frame showing each arrow of the sequence was grabbed
+        self.captured_at = 0.0
+        # from grabbing the frame that showed the sequence was over until each key is pressed, i.e. how quickly
+        # the solver reacts. `arrow_latency` is from each arrow's own frame instead, which mostly measures how long
+        # the game takes to show the rest of the sequence
+        self.keypress_latency = Histogram()
+        self.arrow_latency = Histogram()
+
+    def set_scale(self, scale: float) -> None:
+        """
+        Switches to templates for a UI that is `scale` times as large as a 1280x720 client. They are cached,
+        so switching back and forth is cheap.
+        """
+        self.scale = scale
+        self.tracker.scale = scale
+        self.resources = DanceGameSolver.Resources(
+            down=util.template_resource("dance_down.png", scale),
+            right=util.template_resource("dance_right.png", scale),
+            up=util.template_resource("dance_up.png", scale),
+            left=util.template_resource("dance_left.png", scale),
+            empty=util.template_resource("dance_empty.png", scale),
+        )
+
+        self.maxTemplateSize = [0, 0]  # x, y
+        for img in self.resources.__dict__.values():
+            self.maxTemplateSize[0] = max(self.maxTemplateSize[0], img.shape[1])
+            self.maxTemplateSize[1] = max(self.maxTemplateSize[1], img.shape[0])
+
+        self.classifier = util.resources.template_classifier(self.resources.__dict__)
+        self.signatures = util.resources.signature_classifier(self.resources.__dict__)
+        self.last_version = None
 
     def change_state(self, new_state: str | None) -> None:
         self.last_state = self.state
         self.state = new_state
         self.time_state_changed = time.time()
 
+    def classify(self, src: np.ndarray) -> tuple[str, int, int, float]:
+        if self.use_signatures and self.last_classification is not None:
+            label, x, y, difference = self.last_classification
+            if difference <= 0.01:  # the game hasn't moved since, so only check which arrow is there now
+                label, distance, confident = self.signatures.classify(src, x, y)
+                if confident:
+                    return label, x, y, 0.0
+
+        return self.classifier.classify(src)
+
+    @timed("loop:dance")
     def loop(self) -> None:
         [cx, cy] = self.known_location
         [w, h] = self.maxTemplateSize
         ox, oy = int(cx + 0.5 - w / 2 - 10), int(cy + 0.5 - h / 2 - 10)
-        src = self.da.grab(ox, oy, w + 20, h + 20)
+        if self.background_capture:
+            # the next frame is grabbed while this one is being matched
+            region = {"left": ox, "top": oy, "width": w + 20, "height": h + 20}
+            if not self.da.capturing:
+                self.da.start_capture(region, fps=60)
+            elif self.da.capture_region != region:
+                self.da.set_capture_region(region)
 
-        # figure out which template is in the image
-        d = []
-        for k, img in self.resources.__dict__.items():
-            d.append([k, *self.da.find_in_image(src, img)])
+            frame = self.da.latest_frame(after=self.last_sequence, timeout=0.1)
+            if frame is None or frame.region != region:
+                return
+            self.last_sequence = frame.sequence
+            self.captured_at = frame.timestamp
+            src = frame.image
+        else:
+            self.captured_at = time.time()
+            src = self.da.grab(ox, oy, w + 20, h + 20)
 
-        d.sort(key=lambda x: x[-1])
-        [k, x, y, t] = d[0]
+        # figure out which template is in the image, unless it looks exactly like it did last time
+        version = (ox, oy, self.da.region_version("dance", src))
+        classification = self.last_classification
+        if version != self.last_version or classification is None:
+            classification = self.last_classification = self.classify(src)
+            self.last_version = version
+        k, x, y, t = classification
         x += ox
         y += oy
 
@@ -63,22 +134,31 @@ class DanceGameSolver:
                 if (
                     time.time() - self.time_state_changed > 1
                 ):  # found nothing for 1 second... user moved window or closed pet game
-                    self.time_state_changed = time.time()  # reset the timer as to only search every 1 second
                     self.sequence = None  # cancel any sequence
 
-                    fullscreen = self.da.grab_fullscreen()
                     empty = self.resources.empty
 
                     w, h, _ = empty.shape
-                    x, y, t = self.da.find_in_image(fullscreen, empty)
+                    x, y, t = self.tracker.locate(empty)  # starts near where it was last seen
+                    if t >= 0.01 and self.detect_scale and self.scale_backoff.ready():  # maybe the client was resized
+                        scale, x, y, t = self.da.detect_scale(util.template_resource("dance_empty.png"))
+                        if t >= 0.01:
+                            self.scale_backoff.failed()  # stamped after the search, which can take seconds
+                        elif scale != self.scale:
+                            print(f"The game's UI is drawn at {scale:.2f}x")
+                            self.set_scale(scale)
+                            empty = self.resources.empty
+                            w, h, _ = empty.shape
+
+                    # reset the timer as to only search every 1 second, counted from when this search finished
+                    self.time_state_changed = time.time()
                     if t < 0.01:  # FOUND!
+                        self.scale_backoff.succeeded()
                         print("Found game window! Now tracking dance sequences.")
                         self.known_location = [x + w / 2, y + h / 2]
                         self.change_state("empty")
                     elif not self.printed_not_found:  # not found
-                        print(
-                            "Waiting for you to enter the dance game... Make sure you're playing in 1280x720 resolution. (prefer no fullscreen)"
-                        )
+                        print("Waiting for you to enter the dance game... (prefer no fullscreen)")
                         self.printed_not_found = True
                 else:
                     pass  # failed to find
@@ -87,7 +167,9 @@ class DanceGameSolver:
         elif k != self.state and k in ["down", "right", "up", "left"]:
             if self.sequence == None:
                 self.sequence = []
+                self.sequence_seen = []
             self.sequence.append(k)
+            self.sequence_seen.append(self.captured_at)
             print("Remember:", k)
         elif (
             k == "empty"
@@ -97,11 +179,96 @@ class DanceGameSolver:
             and len(self.sequence) >= 3
         ):
             print("Entering full sequence:", ", ".join(self.sequence))
-            for dir in self.sequence:
-                keyboard.press_and_release(dir)
+            for dir, seen in zip(self.sequence, self.sequence_seen):
+                self.da.press_and_release(dir)
+                pressed = time.time()
+                self.keypress_latency.record(pressed - self.captured_at)
+                self.arrow_latency.record(pressed - seen)
                 time.sleep(0.01)
             self.sequence = None
 
+        if t <= 0.01 and k == "empty":
+            self.tracker.remember(self.resources.empty, x, y)
+
         if t <= 0.01 and k != self.state:
             self.printed_not_found = False
             self.change_state(k)
+
+
+class DanceScheduler:
+    """
+    Runs a `DanceGameSolver` at `tracking_fps` while it is tracking the game, and at `idle_fps` while it is only
+    waiting for the game to show up (it searches for it once a second at most anyway), instead of spinning.
+    Keeps count of late frames (the loop took longer than a frame) and dropped frames (frames skipped entirely).
+    """
+
+    def __init__(self, solver: DanceGameSolver, tracking_fps: float = 60, idle_fps: float = 4):
+        self.solver = solver
+        self.tracking_fps = tracking_fps
+        self.idle_fps = idle_fps
+
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+        self.loop_time = Histogram()
+        self.next_frame = time.perf_counter()
+
+    @property
+    def tracking(self) -> bool:
+        return self.solver.state is not None
+
+    def interval(self) -> float:
+        return 1 / (self.tracking_fps if self.tracking else self.idle_fps)
+
+    def step(self) -> None:
+        """
+        Runs the solver once, then sleeps until its next frame is due.
+        """
+        started = time.perf_counter()
+        self.solver.loop()
+        finished = time.perf_counter()
+
+        self.frames += 1
+        self.loop_time.record(finished - started)
+
+        interval = self.interval()
+        self.next_frame = max(self.next_frame, started) + interval
+        if finished > self.next_frame:  # ran into the next frame's time
+            self.late += 1
+            self.dropped += int((finished - self.next_frame) / interval)
+            self.next_frame = finished  # don't try to catch up on frames that were missed
+
+        time.sleep(max(0, self.next_frame - time.perf_counter()))
+
+    def report(self) -> str:
+        latency = self.solver.keypress_latency
+        return (
+            f"{self.frames} frames ({self.late} late, {self.dropped} dropped),"
+            f" loop p50 {self.loop_time.percentile(50) * 1000:.2f} ms p99 {self.loop_time.percentile(99) * 1000:.2f} ms,"
+            f" frame to key press p50 {latency.percentile(50) * 1000:.0f} ms"
+            f" p99 {latency.percentile(99) * 1000:.0f} ms ({latency.count} keys)"
+        )
+
+    def run(
+        self,
+        should_stop: Callable[[], bool] = lambda: False,
+        stop_interval: float = 0.1,
+        report_interval: float | None = None,
+    ) -> None:
+        """
+        Steps until `should_stop` returns True. It is only asked every `stop_interval` seconds, since it is usually
+        something slow like `keyboard.is_pressed`. Prints `report` every `report_interval` seconds, if given.
+        """
+        next_stop_check = next_report = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now >= next_stop_check:
+                if should_stop():
+                    break
+                next_stop_check = now + stop_interval
+
+            if report_interval is not None and now >= next_report + report_interval:
+                print(self.report())
+                next_report = now
+
+            self.step()
@@ -1,96 +1,1328 @@
-import cv2, mss
+import cv2
 import numpy as np
 import pathlib
-from PIL import ImageFont
-import mouse
 import time
 import sqlite3
+import json
+import threading
+import contextlib
+import zipfile
+from collections import deque
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, ContextManager, Mapping
+
+from wizard101.instrumentation import span
+
+# these are only needed once something is actually captured, clicked or drawn, so they are imported on demand
+if TYPE_CHECKING:
+    from PIL import ImageFont
 
 file_root = pathlib.Path(__file__).parent
 
 
-class DesktopAutomator:
+class PreparedTemplate:
+    """
+    A template that has already been converted into the form that `DesktopAutomator.find_in_image` needs.
+    Build these once (i.e. when a solver is constructed) rather than passing raw images on every frame.
+    """
+
+    method = cv2.TM_SQDIFF_NORMED
+
+    def __init__(self, image: np.ndarray, name: str = ""):
+        self.name = name
+        self.image = image
+        self.height, self.width = image.shape[:2]
+        self.has_alpha = image.ndim == 3 and image.shape[-1] == 4
+        self.is_float = str(image.dtype).startswith("float")
+
+        self.mask = None
+        if self.has_alpha:  # use alpha as the mask
+            if self.is_float:
+                self.mask = np.ascontiguousarray(image[:, :, 3:], dtype=np.float32)
+            else:
+                self.mask = image[:, :, 3:] / np.float32(255)
+
+        self._downscaled: dict[int, PreparedTemplate] = {}
+        self._rescaled: dict[float, PreparedTemplate] = {}
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.image.shape
+
+    def prepare_haystack(self, image: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Adds or strips the alpha channel of `image` so that it can be matched against this template.
+        Stripping alpha is just a view. Adding it is written into `out` when given (see `DesktopAutomator.buffer`).
+        """
+        if self.has_alpha and image.shape[-1] == 3:  # image has no alpha, but template does. Add opaque alpha
+            if image.dtype == np.uint8 or image.dtype == np.float32:
+                # alpha is 255 for uint8 and 1.0 for float32
+                return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA, dst=out)  # type: ignore
+
+            opaque = np.float32(1) if str(image.dtype).startswith("float") else np.uint8(255)
+            return np.dstack((image, np.full(image.shape[:2], opaque)))
+        elif not self.has_alpha and image.shape[-1] == 4:  # image has alpha but template does not, strip it
+            return image[:, :, :3]
+
+        return image
+
+    def match(self, image: np.ndarray) -> tuple[int, int, float]:
+        """
+        Exhaustively matches against an image that has already been passed through `prepare_haystack`.
+        """
+        match = cv2.matchTemplate(image, self.image, self.method, None, self.mask)  # type: ignore
+        min_value, max_value, min_loc, max_loc = cv2.minMaxLoc(match)
+
+        return min_loc[0], min_loc[1], min_value
+
+    def downscaled(self, factor: int) -> "PreparedTemplate":
+        """
+        This template shrunk by `factor` in each direction, used for the coarse step of a pyramid search.
+        """
+        if factor not in self._downscaled:
+            size = (max(1, self.width // factor), max(1, self.height // factor))
+            image = cv2.resize(self.image, size, interpolation=cv2.INTER_AREA)
+            self._downscaled[factor] = PreparedTemplate(image, name=self.name)
+
+        return self._downscaled[factor]
+
+    def rescaled(self, scale: float) -> "PreparedTemplate":
+        """
+        This template as it looks when the game's UI is drawn `scale` times as large (see `detect_scale`).
+        """
+        scale = round(scale, 3)
+        if scale == 1:
+            return self
+
+        if scale not in self._rescaled:
+            size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            image = cv2.resize(self.image, size, interpolation=interpolation)
+            self._rescaled[scale] = PreparedTemplate(image, name=f"{self.name}@{scale:g}x" if self.name else "")
+
+        return self._rescaled[scale]
+
+
+class TemplateClassifier:
+    """
+    Scores several same-sized templates against one small image at the same time and reports the best one.
+    This is equivalent to calling `DesktopAutomator.find_in_image` once per template and keeping the lowest
+    difference, but every correlation is done in a single batch of FFTs instead of one `matchTemplate` each.
+    """
+
+    def __init__(self, templates: Mapping[str, "np.ndarray | PreparedTemplate"]):
+        self.labels = list(templates.keys())
+        self.templates = [
+            t if isinstance(t, PreparedTemplate) else PreparedTemplate(t, name=k) for k, t in templates.items()
+        ]
+        if not self.templates:
+            raise ValueError("TemplateClassifier needs at least one template")
+        if len({t.shape for t in self.templates}) != 1:
+            raise ValueError("All templates given to a TemplateClassifier must have the same shape")
+
+        first = self.templates[0]
+        self.height, self.width = first.height, first.width
+        self.shape = first.shape
+
+        # every template is stored as (mask * template), with the mask broadcast over the channels
+        masks = [
+            np.ones((self.height, self.width), np.float64) if t.mask is None else np.float64(t.mask[:, :, 0])
+            for t in self.templates
+        ]
+        pixels = [np.float64(t.image).reshape(self.height, self.width, -1) for t in self.templates]
+
+        self.masks_squared = np.stack([m * m for m in masks])  # (k, h, w)
+        self.weighted = np.stack([p * (m * m)[:, :, None] for p, m in zip(pixels, masks)])  # (k, h, w, c)
+        self.template_energy = np.array([np.sum((p * m[:, :, None]) ** 2) for p, m in zip(pixels, masks)])  # (k,)
+
+        self._spectra: dict[tuple[int, int], tuple[np.ndarray, np.ndarray]] = {}
+
+    def get_spectra(self, height: int, width: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Conjugated FFTs of the weighted templates and squared masks, zero padded to the size of the image.
+        These only depend on the image size, so they are computed once per size.
+        """
+        key = (height, width)
+        if key not in self._spectra:
+            weighted = np.fft.rfft2(np.moveaxis(self.weighted, -1, 1), s=key)  # (k, c, H, W/2+1)
+            masks_squared = np.fft.rfft2(self.masks_squared, s=key, axes=(1, 2))  # (k, H, W/2+1)
+            self._spectra[key] = np.conj(weighted), np.conj(masks_squared)
+
+        return self._spectra[key]
+
+    def score(self, image: np.ndarray) -> np.ndarray:
+        """
+        Returns the TM_SQDIFF_NORMED result of every template, stacked into one (k, H - h + 1, W - w + 1) array.
+        """
+        image = np.float64(self.templates[0].prepare_haystack(image))
+        height, width = image.shape[:2]
+        if height < self.height or width < self.width:
+            raise ValueError(f"Image of shape {image.shape} is smaller than the templates {self.shape}")
+
+        image = image.reshape(height, width, -1)
+        weighted, masks_squared = self.get_spectra(height, width)
+
+        channels = np.fft.rfft2(np.moveaxis(image, -1, 0))  # (c, H, W/2+1)
+        energy = np.fft.rfft2(np.sum(image * image, axis=-1))  # (H, W/2+1)
+
+        # correlate everything at once, the valid region of a circular correlation never wraps around
+        cross = np.fft.irfft2(np.sum(weighted * channels[None], axis=1), s=(height, width))  # (k, H, W)
+        image_energy = np.fft.irfft2(masks_squared * energy[None], s=(height, width))  # (k, H, W)
+
+        valid = (slice(None), slice(0, height - self.height + 1), slice(0, width - self.width + 1))
+        cross, image_energy = cross[valid], np.maximum(image_energy[valid], 0)
+
+        template_energy = self.template_energy[:, None, None]
+        difference = np.maximum(template_energy - 2 * cross + image_energy, 0)
+        return difference / np.maximum(np.sqrt(template_energy * image_energy), np.finfo(np.float64).eps)
+
+    def classify(self, image: np.ndarray) -> tuple[str, int, int, float]:
+        """
+        Returns the label of the best matching template, and where (and how well) it matched.
+        """
+        with span("match:classifier"):
+            scores = self.score(image)
+        k, y, x = np.unravel_index(np.argmin(scores), scores.shape)
+        return self.labels[k], int(x), int(y), float(scores[k, y, x])
+
+
+class SignatureClassifier:
+    """
+    Tells same-sized templates apart by a tiny signature: the colors of a few dozen probe pixels, picked where the
+    templates differ the most (and away from their edges). The signature of an image is compared against a table
+    of the templates' signatures, which takes microseconds instead of a full template match.
+
+    This only looks at one position, so it is meant for a template that is expected to be exactly where it last
+    was. When it isn't sure, fall back to a `TemplateClassifier` (or `DesktopAutomator.find_in_image`).
+    """
+
+    def __init__(
+        self,
+        templates: Mapping[str, "np.ndarray | PreparedTemplate"],
+        probes: int = 32,
+        max_distance: float = 16.0,
+        min_margin: float = 2.0,
+    ):
+        self.labels = list(templates.keys())
+        self.templates = [
+            t if isinstance(t, PreparedTemplate) else PreparedTemplate(t, name=k) for k, t in templates.items()
+        ]
+        if not self.templates:
+            raise ValueError("SignatureClassifier needs at least one template")
+        if len({t.shape for t in self.templates}) != 1:
+            raise ValueError("All templates given to a SignatureClassifier must have the same shape")
+
+        first = self.templates[0]
+        self.height, self.width = first.height, first.width
+        self.max_distance = max_distance  # the most an image may differ from a template (RMS, in 0-255 levels)
+        self.min_margin = min_margin  # how many times closer the best template must be than the runner up
+
+        pixels = [np.float32(t.image[:, :, :3]) * (255 if t.is_float else 1) for t in self.templates]
+        self.probe_y, self.probe_x = self.pick_probes(pixels, probes)
+        self.table = np.stack([p[self.probe_y, self.probe_x].ravel() for p in pixels])  # (k, probes * 3)
+
+    def pick_probes(self, pixels: list[np.ndarray], count: int) -> tuple[np.ndarray, np.ndarray]:
+        # only where every template is opaque, and not right at an edge, so that a little blur doesn't matter
+        opaque = np.ones((self.height, self.width), np.uint8)
+        for t in self.templates:
+            if t.mask is not None:
+                opaque &= np.uint8(t.mask[:, :, 0] >= 1)
+        allowed = cv2.erode(opaque, np.ones((5, 5), np.uint8)).astype(bool)
+
+        # how different each pair of templates is around each pixel
+        blurred = [cv2.blur(p, (3, 3)) for p in pixels]
+        pairs = [(i, j) for i in range(len(pixels)) for j in range(i + 1, len(pixels))]
+        separation = np.stack([np.abs(blurred[i] - blurred[j]).mean(axis=-1) for i, j in pairs] or [opaque * 1.0])
+        separation = np.minimum(separation, 64)
+
+        # greedily take the pixel that separates the least separated pairs the most, spread out a little
+        ys, xs, covered = [], [], np.zeros(len(separation))
+        for _ in range(count):
+            gain = (separation / (1 + covered[:, None, None])).sum(axis=0) * allowed
+            if not allowed.any():
+                break
+            y, x = np.unravel_index(np.argmax(gain), gain.shape)
+            ys.append(y)
+            xs.append(x)
+            covered += separation[:, y, x]
+            allowed[max(0, y - 3) : y + 4, max(0, x - 3) : x + 4] = False
+
+        return np.array(ys, np.intp), np.array(xs, np.intp)
+
+    def signature(self, image: np.ndarray) -> np.ndarray:
+        probes = np.float32(image[self.probe_y, self.probe_x, :3])
+        if str(image.dtype).startswith("float"):
+            probes *= 255
+        return probes.ravel()
+
+    def classify(self, image: np.ndarray, x: int = 0, y: int = 0) -> tuple[str, float, bool]:
+        """
+        Returns the label of the template that looks most like `image` at (x, y), how different they are
+        and whether that is a confident answer.
+        """
+        window = image[y : y + self.height, x : x + self.width]
+        if x < 0 or y < 0 or window.shape[:2] != (self.height, self.width):
+            return self.labels[0], np.inf, False
+
+        squared = ((self.table - self.signature(window)) ** 2).sum(axis=1)
+        best = int(np.argmin(squared))
+        distance = float(np.sqrt(squared[best] / self.table.shape[1]))
+
+        squared[best] = np.inf
+        runner_up = float(np.sqrt(squared.min() / self.table.shape[1]))
+        confident = distance <= self.max_distance and distance * self.min_margin <= runner_up
+        return self.labels[best], distance, confident
+
+
+@dataclass
+class Frame:
+    image: np.ndarray
+    timestamp: float  # `time.time()` right before the frame was grabbed
+    sequence: int  # increases by one for every frame grabbed by the same capture thread
+    region: dict[str, int]
+
+    def contains(self, x: int, y: int, w: int, h: int) -> bool:
+        left, top = self.region["left"], self.region["top"]
+        return left <= x and top <= y and x + w <= left + self.region["width"] and y + h <= top + self.region["height"]
+
+    def crop(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        x, y = x - self.region["left"], y - self.region["top"]
+        return self.image[y : y + h, x : x + w]
+
+
+class FrameSource:
+    """
+    Where `DesktopAutomator` gets its pixels from. `monitors` follows the layout of `mss.mss().monitors`:
+    the first entry is the bounding box of the whole desktop, and the rest are the individual monitors.
+    """
+
+    monitors: list[dict[str, int]]
+    interactive = True  # whether mouse/keyboard input should actually be sent
+
+    def grab(self, region: dict[str, int]) -> np.ndarray:
+        """
+        Returns the BGRA pixels of `region` (in desktop coordinates).
+        """
+        raise NotImplementedError
+
+    def for_thread(self) -> "FrameSource":
+        """
+        A source that can be used from a different thread (i.e. the background capture thread).
+        """
+        return self
+
+    def close(self) -> None:
+        pass
+
+
+class MssFrameSource(FrameSource):
+    """
+    The live desktop.
+    """
+
     def __init__(self):
+        import mss
+
         self.sct = mss.mss()
+        self.monitors = self.sct.monitors
+
+    def grab(self, region: dict[str, int]) -> np.ndarray:
+        # mss allocates a fresh buffer for every screenshot, so a view of it stays valid after the next grab
+        shot = self.sct.grab(region)
+        return np.frombuffer(shot.raw, np.uint8).reshape(shot.height, shot.width, 4)
+
+    def for_thread(self) -> "MssFrameSource":
+        return MssFrameSource()  # mss instances can't be shared between threads on every platform
+
+    def close(self) -> None:
+        self.sct.close()
+
+
+class ReplayFrameSource(FrameSource):
+    """
+    Plays back previously captured frames. Every frame has a timestamp (in seconds from the first frame).
+
+    With `speed=None` the current frame only changes when `step` is called, so every run sees exactly the same
+    frames no matter how fast the code under test is. Otherwise, frames are replayed in real time (times `speed`).
+    Input is never sent while replaying.
+    """
+
+    interactive = False
+
+    def __init__(self, timestamps: list[float], origin: tuple[int, int] = (0, 0), speed: float | None = None):
+        self.timestamps = timestamps
+        self.origin = origin
+        self.speed = speed
+
+        self.index = 0
+        self.started = time.time()
+        self.cache: tuple[int, np.ndarray] | None = None
+
+        height, width = self.frame(0).shape[:2]
+        desktop = {"left": origin[0], "top": origin[1], "width": width, "height": height}
+        self.monitors = [desktop, dict(desktop)]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def load(self, index: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def frame(self, index: int) -> np.ndarray:
+        if self.cache is None or self.cache[0] != index:
+            self.cache = index, self.load(index)
+
+        return self.cache[1]
+
+    @property
+    def finished(self) -> bool:
+        if self.speed is None:
+            return self.index >= len(self) - 1
+        return (time.time() - self.started) * self.speed > self.timestamps[-1]
+
+    def step(self) -> bool:
+        """
+        Moves on to the next frame. Returns False if there are no frames left.
+        """
+        if self.index >= len(self) - 1:
+            return False
+
+        self.index += 1
+        return True
+
+    def current_index(self) -> int:
+        if self.speed is None:
+            return self.index
+
+        elapsed = (time.time() - self.started) * self.speed
+        return max(0, int(np.searchsorted(self.timestamps, elapsed, side="right")) - 1)
+
+    def grab(self, region: dict[str, int]) -> np.ndarray:
+        image = self.frame(self.current_index())
+        height, width = image.shape[:2]
+
+        # anything outside of the recording is black
+        x, y = region["left"] - self.origin[0], region["top"] - self.origin[1]
+        result = np.zeros((int(region["height"]), int(region["width"]), 4), np.uint8)
+        left, top = max(0, x), max(0, y)
+        right, bottom = min(width, x + region["width"]), min(height, y + region["height"])
+        if left < right and top < bottom:
+            result[top - y : bottom - y, left - x : right - x] = image[top:bottom, left:right]
+
+        return result
+
+
+class DirectoryFrameSource(ReplayFrameSource):
+    """
+    Replays every PNG in a directory, in filename order, as if they were captured `fps` times per second.
+    """
+
+    def __init__(self, path: str | pathlib.Path, fps: float = 30, **kwargs):
+        self.paths = sorted(pathlib.Path(path).glob("*.png"))
+        if not self.paths:
+            raise FileNotFoundError(f"There are no PNG frames in {str(path)!r}")
+
+        super().__init__([i / fps for i in range(len(self.paths))], **kwargs)
+
+    def load(self, index: int) -> np.ndarray:
+        image = cv2.imread(str(self.paths[index]), cv2.IMREAD_UNCHANGED)
+        if image.shape[-1] == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+        return image
+
+
+class RecordedFrameSource(ReplayFrameSource):
+    """
+    Replays a session saved by `record_session` (a compressed .npz). Frames are decompressed one at a time.
+    """
+
+    def __init__(self, path: str | pathlib.Path, **kwargs):
+        self.archive = np.load(str(path))
+        origin = tuple(int(v) for v in self.archive["origin"])
+        super().__init__(list(self.archive["timestamps"]), origin=origin, **kwargs)  # type: ignore
+
+    def load(self, index: int) -> np.ndarray:
+        return self.archive[f"frame_{index:06d}"]
+
+    def close(self) -> None:
+        self.archive.close()
+
+
+def record_session(
+    path: str | pathlib.Path, region: dict[str, int] | None = None, duration: float = 10, fps: float = 30
+) -> int:
+    """
+    Captures `region` of the live desktop (everything by default) into a file for `RecordedFrameSource`.
+    Returns the number of frames recorded.
+    """
+    source = MssFrameSource()
+    region = region or source.monitors[0]
+
+    path = str(path)
+    if not path.endswith(".npz"):  # like `np.savez_compressed` does
+        path += ".npz"
+
+    def write(archive: zipfile.ZipFile, name: str, array: np.ndarray) -> None:
+        with archive.open(f"{name}.npy", "w", force_zip64=True) as file:
+            np.save(file, array)
+
+    # each frame is compressed into the archive as soon as it's captured, since a few hundred frames of the whole
+    # desktop wouldn't fit in memory. The result reads back with `np.load` exactly like `np.savez_compressed`'s
+    timestamps = []
+    started = time.time()
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        while time.time() - started < duration:
+            timestamps.append(time.time() - started)
+            write(archive, f"frame_{len(timestamps) - 1:06d}", source.grab(region))
+            time.sleep(max(0, started + len(timestamps) / fps - time.time()))
+
+        source.close()
+        write(archive, "timestamps", np.array(timestamps))
+        write(archive, "origin", np.array([region["left"], region["top"]]))
+
+    return len(timestamps)
+
+
+class ChangeDetector:
+    """
+    Tells whether a region of the screen looks different than it did the last time it was checked.
+    Every time it does, `version` goes up by one, so "has it changed since version N?" is just `version != N`.
+
+    With the default `tolerance` of 0 the pixels are compared exactly. Otherwise, both images are shrunk by
+    `downsample` and only count as different if some pixel differs by more than `tolerance`.
+    """
+
+    def __init__(self, tolerance: int = 0, downsample: int = 1):
+        self.tolerance = tolerance
+        self.downsample = downsample
+        self.version = 0
+        self.previous: np.ndarray | None = None
+
+    def signature(self, image: np.ndarray) -> np.ndarray:
+        if self.downsample <= 1:
+            return image
+
+        height, width = image.shape[:2]
+        size = (max(1, width // self.downsample), max(1, height // self.downsample))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def update(self, image: np.ndarray) -> int:
+        signature = self.signature(image)
+
+        if self.previous is None or self.previous.shape != signature.shape:
+            changed = True
+        elif self.tolerance <= 0:
+            changed = not np.array_equal(self.previous, signature)
+        else:
+            changed = cv2.absdiff(self.previous, signature).max() > self.tolerance
+
+        if changed:
+            self.version += 1
+            self.previous = signature.copy()
+
+        return self.version
+
+
+@dataclass
+class WaitResult:
+    success: bool  # whether the condition held before the timeout
+    x: int  # where the template was last seen, in screen coordinates
+    y: int
+    difference: float
+    elapsed: float  # seconds from the start of the wait until the condition was first observed
+    polls: int  # how many times the region was looked at
+
+
+# the UI scale of common client sizes, relative to the 1280x720 client the bundled templates were taken from
+UI_SCALES = (0.75, 1.0, 1280 / 1366, 1366 / 1280, 1.25, 1.5, 2.0, 2.5, 3.0)
+
+
+@dataclass
+class InputTiming:
+    """
+    How long mouse and keyboard input takes. The defaults are slow enough for any UI; see `FAST_INPUT`.
+    """
+
+    move_duration: float = 0.05  # how long the cursor glides to its target, 0 warps it there
+    move_settle: float = 0.05  # pause after every move, so that the game notices the hover
+    press_duration: float = 0.05  # how long mouse buttons are held down
+    release_settle: float = 0.01  # pause after releasing a mouse button
+    drag_duration: float = 0.05  # how long the cursor glides while dragging (sliders ignore warps)
+    key_press_duration: float = 0.0  # how long keys are held down, 0 taps them
+    restore_cursor: bool = True  # move the cursor back to where it was after clicking or dragging
+    confirm_timeout: float = 1.0  # how long `click(..., confirm=roi)` waits for the screen to react
+
+
+FAST_INPUT = InputTiming(
+    move_duration=0, move_settle=0.01, press_duration=0.02, release_settle=0, drag_duration=0.05, restore_cursor=False
+)
+
+
+class DesktopAutomator:
+    def __init__(self, source: FrameSource | None = None, timing: InputTiming | None = None):
+        self.source = source or MssFrameSource()
+        self.timing = timing or InputTiming()
+        self.buffers: dict[tuple, np.ndarray] = {}
+
+        # background capture, see `start_capture`
+        self.frames: deque[Frame] = deque(maxlen=4)
+        self.capture_region: dict[str, int] | None = None
+        self.capture_interval = 1 / 60
+        self.capture_thread: threading.Thread | None = None
+        self.new_frame = threading.Condition()
+        self.last_input_time = 0.0
+        self.change_detectors: dict[str, ChangeDetector] = {}
+
+        # entered around every click, drag and key press, i.e. to take turns with other clients (see `orchestrator`)
+        self.input_turn: Callable[[], ContextManager] = contextlib.nullcontext
 
     def __del__(self):
         try:
-            del self.sct
+            self.stop_capture()
+            self.source.close()
         except:
             pass
 
+    @property
+    def capturing(self) -> bool:
+        return self.capture_thread is not None
+
+    def start_capture(self, region: dict[str, int] | None = None, fps: float = 60, history: int = 4) -> None:
+        """
+        Starts grabbing `region` (the whole desktop by default) on a background thread, `fps` times per second.
+        The newest `history` frames are kept, and `latest_frame`/`latest` return them without blocking on a grab.
+        """
+        self.stop_capture()
+
+        self.frames = deque(maxlen=history)
+        self.capture_region = region or self.source.monitors[0]
+        self.capture_interval = 1 / fps
+        self.capture_thread = threading.Thread(target=self.capture_forever, daemon=True)
+        self.capture_thread.start()
+
+    def set_capture_region(self, region: dict[str, int]) -> None:
+        self.capture_region = dict(region)
+
+    def stop_capture(self) -> None:
+        thread, self.capture_thread = self.capture_thread, None
+        if thread is not None:
+            thread.join()
+
+    def capture_forever(self) -> None:
+        thread = threading.current_thread()
+        source = self.source.for_thread()
+
+        sequence = 0
+        next_capture = time.time()
+        while self.capture_thread is thread:
+            region = self.capture_region
+            assert region is not None
+
+            timestamp = time.time()
+            image = source.grab(region)
+
+            with self.new_frame:
+                self.frames.append(Frame(image=image, timestamp=timestamp, sequence=sequence, region=region))
+                self.new_frame.notify_all()
+            sequence += 1
+
+            # keep a steady rate, but don't try to catch up on frames that were missed
+            next_capture = max(next_capture + self.capture_interval, time.time())
+            time.sleep(max(0, next_capture - time.time()))
+
+        if source is not self.source:
+            source.close()
+
+    def latest_frame(self, after: int = -1, timeout: float | None = None) -> Frame | None:
+        """
+        Returns the newest captured frame if its sequence number is greater than `after`.
+        By default this never blocks. Pass a `timeout` to wait that long for such a frame to arrive.
+        """
+        with self.new_frame:
+            if timeout is not None:
+                self.new_frame.wait_for(lambda: self.frames and self.frames[-1].sequence > after, timeout)
+
+            if self.frames and self.frames[-1].sequence > after:
+                return self.frames[-1]
+
+        return None
+
+    def latest(
+        self,
+        x: int | float,
+        y: int | float,
+        w: int | float,
+        h: int | float,
+        newer_than: float | None = None,
+        timeout: float = 1,
+    ) -> np.ndarray:
+        """
+        Like `grab`, but crops the newest background frame when it covers the area. By default the frame must
+        have been grabbed after the last click/drag, so that it reflects it.
+        Falls back to grabbing synchronously when nothing is being captured there.
+        """
+        if newer_than is None:
+            newer_than = self.last_input_time
+
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        if self.capturing:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                frame = self.latest_frame()
+                if frame is None or not frame.contains(x, y, w, h):
+                    break
+                if frame.timestamp > newer_than:
+                    return frame.crop(x, y, w, h)
+
+                self.latest_frame(after=frame.sequence, timeout=max(0, deadline - time.time()))
+
+        return self.grab(x, y, w, h)
+
     def grab_monitor(self, mon) -> np.ndarray:
-        return np.array(self.sct.grab(mon))
+        """
+        Returns the BGRA pixels of `mon`. For the live desktop, this is a view of the screenshot's own buffer,
+        which mss never reuses, so it stays valid (i.e. in the background capture's history) without a copy.
+        """
+        with span("capture"):
+            return self.source.grab(mon)
 
     def grab(self, x: int | float, y: int | float, w: int | float, h: int | float) -> np.ndarray:
         return self.grab_monitor({"top": y, "left": x, "width": w, "height": h})
 
+    def buffer(self, shape: tuple[int, ...], dtype: "np.dtype | type" = np.uint8, name: str = "") -> np.ndarray:
+        """
+        A preallocated array that is reused by every caller asking for the same shape, dtype and name.
+        Its contents are overwritten by the next user, so don't hold on to it.
+        """
+        key = (tuple(shape), np.dtype(dtype), name)
+        if key not in self.buffers:
+            self.buffers[key] = np.empty(shape, dtype)
+
+        return self.buffers[key]
+
+    def region_version(self, name: str, image: np.ndarray, tolerance: int = 0, downsample: int = 1) -> int:
+        """
+        Returns a number that only changes when `image` looks different from the last image checked under `name`.
+        If it's the same number as last time, whatever was computed from the last image is still valid.
+        """
+        if name not in self.change_detectors:
+            self.change_detectors[name] = ChangeDetector(tolerance=tolerance, downsample=downsample)
+
+        return self.change_detectors[name].update(image)
+
     def grab_fullscreen(self) -> np.ndarray:
-        return self.grab_monitor(self.sct.monitors[0])
+        return self.grab_monitor(self.source.monitors[0])
 
-    def find_in_image(self, image: np.ndarray, template: np.ndarray) -> tuple[int, int, float]:
-        mask = None
+    def find_in_image(
+        self, image: np.ndarray, template: "np.ndarray | PreparedTemplate", pyramid: int = 1
+    ) -> tuple[int, int, float]:
+        """
+        Finds the location where `template` best matches `image`, and how different it is (0 is a perfect match).
 
-        if template.shape[-1] == 4:  # has alpha, use mask
-            if str(template.dtype).startswith("float"):
-                if template.dtype == "float32":
-                    mask = template[:, :, 3:]
-                else:
-                    mask = np.float32(template[:, :, 3:])
-            else:
-                mask = template[:, :, 3:] / np.float32(255)
+        Passing `pyramid=4` (or 8) first searches a copy of both images shrunk by that factor, and then only
+        searches small windows around the best few coarse candidates at full resolution. This is *much* faster
+        on large images (i.e. the whole desktop), and finds the same match as the exhaustive search unless the
+        template is barely distinguishable from its surroundings once shrunk.
+        """
+        if not isinstance(template, PreparedTemplate):
+            template = PreparedTemplate(template)
 
-            if image.shape[-1] == 3:  # image has no alpha, but template does. Add alpha to image
-                opaque = np.uint8(255)
-                if str(image.dtype).startswith("float"):
-                    opaque = np.float32(1)
+        out = None
+        if template.has_alpha and image.shape[-1] == 3:
+            out = self.buffer((*image.shape[:2], 4), image.dtype, "haystack")
 
-                image = np.dstack((image.copy(), np.full(image.shape[:2], opaque)))
-        else:
-            if image.shape[-1] == 4:  # image has alpha but template does not, strip alpha from image
-                image = image.copy()[:, :, :3]
+        with span(f"match:{template.name or 'unnamed'}"):
+            image = template.prepare_haystack(image, out=out)
+            if pyramid > 1:
+                return self.pyramid_search(image, template, pyramid)
 
-        match = cv2.matchTemplate(image, template, cv2.TM_SQDIFF_NORMED, None, mask)  # type: ignore
-        min_value, max_value, min_loc, max_loc = cv2.minMaxLoc(match)
+            return template.match(image)
 
-        return min_loc[0], min_loc[1], min_value
+    def pyramid_search(
+        self, image: np.ndarray, template: PreparedTemplate, factor: int, candidates: int = 3
+    ) -> tuple[int, int, float]:
+        coarse_template = template.downscaled(factor)
+        image_height, image_width = image.shape[:2]
+
+        # not enough detail left to search at the coarse scale, so just search exhaustively
+        if (
+            min(coarse_template.width, coarse_template.height) < 4
+            or image_width * image_height < 4 * template.width * template.height
+        ):
+            return template.match(image)
+
+        coarse_size = (image_width // factor, image_height // factor)
+        coarse_image = self.buffer((*coarse_size[::-1], *image.shape[2:]), image.dtype, "coarse")
+        cv2.resize(image, coarse_size, dst=coarse_image, interpolation=cv2.INTER_AREA)
+        coarse = cv2.matchTemplate(
+            coarse_image, coarse_template.image, coarse_template.method, None, coarse_template.mask  # type: ignore
+        )
+        coarse = np.nan_to_num(coarse, nan=np.inf, posinf=np.inf)
+
+        best = None
+        margin = factor * 2
+        for _ in range(candidates):
+            min_value, max_value, (cx, cy), max_loc = cv2.minMaxLoc(coarse)
+            if not np.isfinite(min_value):
+                break
+
+            # refine around this candidate at full resolution
+            left, top = max(0, cx * factor - margin), max(0, cy * factor - margin)
+            right = min(image_width, cx * factor + template.width + margin)
+            bottom = min(image_height, cy * factor + template.height + margin)
+            x, y, value = template.match(image[top:bottom, left:right])
+            if best is None or value < best[2]:
+                best = (left + x, top + y, value)
+
+            # suppress this candidate's neighbourhood so the next one is somewhere else
+            coarse[
+                max(0, cy - coarse_template.height // 2) : cy + coarse_template.height // 2 + 1,
+                max(0, cx - coarse_template.width // 2) : cx + coarse_template.width // 2 + 1,
+            ] = np.inf
+
+        if best is None:  # the coarse search was useless (i.e. a blank screen)
+            return template.match(image)
+
+        return best
+
+    def wait_until(
+        self,
+        template: PreparedTemplate,
+        roi: tuple[int, int, int, int],
+        visible: bool,
+        timeout: float = 10,
+        max_difference: float = 0.01,
+        interval: float = 0.005,
+    ) -> WaitResult:
+        """
+        Polls `roi` (x, y, width, height) every `interval` seconds until `template` is (or isn't) visible in it.
+        Returns as soon as that is observed, or once `timeout` seconds have passed.
+        The template is only matched again when the region's pixels actually change.
+        """
+        x, y, w, h = (int(v) for v in roi)
+        started = time.time()
+        name = f"wait:{template.name or id(template)}"
+
+        with span(f"wait:{'visible' if visible else 'gone'}:{template.name or 'unnamed'}"):
+            version, polls = None, 0
+            found_x, found_y, difference = x, y, 1.0
+            while True:
+                polled_at = time.time()
+                image = self.latest(x, y, w, h, timeout=max(0, started + timeout - polled_at))
+                polls += 1
+
+                new_version = self.region_version(name, image)
+                if new_version != version:
+                    version = new_version
+                    found_x, found_y, difference = self.find_in_image(image, template)
+                    found_x, found_y = found_x + x, found_y + y
+
+                if (difference <= max_difference) == visible:
+                    return WaitResult(True, found_x, found_y, difference, polled_at - started, polls)
+
+                if time.time() - started >= timeout:
+                    return WaitResult(False, found_x, found_y, difference, time.time() - started, polls)
+
+                time.sleep(interval)
+
+    def wait_until_visible(
+        self, template: PreparedTemplate, roi: tuple[int, int, int, int], timeout: float = 10, **kwargs
+    ) -> WaitResult:
+        return self.wait_until(template, roi, visible=True, timeout=timeout, **kwargs)
+
+    def wait_until_gone(
+        self, template: PreparedTemplate, roi: tuple[int, int, int, int], timeout: float = 10, **kwargs
+    ) -> WaitResult:
+        return self.wait_until(template, roi, visible=False, timeout=timeout, **kwargs)
+
+    def detect_scale(
+        self, template: PreparedTemplate, scales: tuple[float, ...] = UI_SCALES, refine: float = 0.02
+    ) -> tuple[float, int, int, float]:
+        """
+        Finds `template` (drawn for a 1280x720 client) on the whole desktop at each of `scales`, and then at a few
+        scales around the best one, `refine` apart. Returns the best scale, where it matched and its difference.
+        This is slow, so do it once and then use `PreparedTemplate.rescaled` (or `template_resource(name, scale)`).
+        """
+        image = self.grab_fullscreen()
+
+        def attempt(scale: float) -> tuple[float, int, int, float]:
+            scaled = template.rescaled(scale)
+            if scaled.width > image.shape[1] or scaled.height > image.shape[0]:
+                return scale, 0, 0, np.inf
+            return (scale, *self.find_in_image(image, scaled, pyramid=4))
+
+        with span("detect_scale"):
+            best = min((attempt(scale) for scale in scales), key=lambda result: result[3])
+            if refine:
+                nearby = [best[0] + refine * step for step in (-2, -1, 1, 2)]
+                best = min([best, *(attempt(scale) for scale in nearby if scale > 0)], key=lambda result: result[3])
+
+        return best
 
     def image_contains(self, img: np.ndarray, other: np.ndarray, maxDifference: int | float) -> bool:
         x, y, t = self.find_in_image(img, other)
         return t < maxDifference
 
-    def move(self, x: float | int, y: float | int) -> tuple[int, int]:
+    def move(self, x: float | int, y: float | int, duration: float | None = None) -> tuple[int, int]:
+        """
+        Moves the cursor to (x, y) and returns where it was before.
+        """
+        if not self.source.interactive:
+            return int(x), int(y)
+
+        import mouse
+
         _x, _y = mouse.get_position()
-        mouse.move(x, y, duration=0.05)  # type: ignore because duration is not an int
-        time.sleep(0.05)
+        mouse.move(x, y, duration=self.timing.move_duration if duration is None else duration)  # type: ignore
+        if self.timing.move_settle:
+            time.sleep(self.timing.move_settle)
         return _x, _y
 
-    def click(self, x: float | int, y: float | int) -> None:
-        _op = self.move(x, y)
-        mouse.press()
-        time.sleep(0.05)
-        mouse.release()
-        time.sleep(0.01)
-        self.move(*_op)
+    def wait_for_change(self, roi: tuple[int, int, int, int], version: int, timeout: float) -> WaitResult:
+        """
+        Waits until `roi` (x, y, width, height) looks different than it did when `region_version` returned `version`,
+        only looking at frames grabbed after the last input.
+        """
+        x, y, w, h = (int(v) for v in roi)
+        name = f"confirm:{x},{y},{w},{h}"
+        started = time.time()
+
+        with span("wait:change"):
+            polls = 0
+            while True:
+                polled_at = time.time()
+                image = self.latest(x, y, w, h, timeout=max(0, started + timeout - polled_at))
+                polls += 1
+
+                if self.region_version(name, image) != version:
+                    return WaitResult(True, x, y, 0.0, polled_at - started, polls)
+
+                if time.time() - started >= timeout:
+                    return WaitResult(False, x, y, 0.0, time.time() - started, polls)
+
+                time.sleep(0.005)
+
+    def confirm_version(self, roi: tuple[int, int, int, int] | None) -> int | None:
+        if roi is None:
+            return None
+
+        x, y, w, h = (int(v) for v in roi)
+        return self.region_version(f"confirm:{x},{y},{w},{h}", self.grab(x, y, w, h))
+
+    def confirm(self, roi: tuple[int, int, int, int] | None, version: int | None) -> bool:
+        if roi is None or version is None:
+            return True
+
+        return self.wait_for_change(roi, version, self.timing.confirm_timeout).success
+
+    def click(self, x: float | int, y: float | int, confirm: tuple[int, int, int, int] | None = None) -> bool:
+        """
+        Clicks at (x, y). If `confirm` is a region (x, y, width, height), this then waits until that region
+        reacts to the click, and returns whether it did before `timing.confirm_timeout`.
+        """
+        version = self.confirm_version(confirm)
+        if self.source.interactive:
+            import mouse
+
+            with self.input_turn(), span("input:click"):
+                _op = self.move(x, y)
+                mouse.press()
+                time.sleep(self.timing.press_duration)
+                mouse.release()
+                if self.timing.release_settle:
+                    time.sleep(self.timing.release_settle)
+                if self.timing.restore_cursor:
+                    self.move(*_op)
+        self.last_input_time = time.time()
+        return self.confirm(confirm, version)
+
+    def drag(
+        self,
+        x1: float | int,
+        y1: float | int,
+        x2: float | int,
+        y2: float | int,
+        confirm: tuple[int, int, int, int] | None = None,
+    ) -> bool:
+        version = self.confirm_version(confirm)
+        if self.source.interactive:
+            import mouse
+
+            with self.input_turn(), span("input:drag"):
+                _op = self.move(x1, y1)
+                mouse.press()
+                time.sleep(self.timing.press_duration)
+                self.move(x2, y2, duration=self.timing.drag_duration)
+                if self.timing.release_settle:
+                    time.sleep(self.timing.release_settle)
+                mouse.release()
+                if self.timing.restore_cursor:
+                    self.move(*_op)
+        self.last_input_time = time.time()
+        return self.confirm(confirm, version)
+
+    def press_and_release(self, key: str) -> None:
+        if self.source.interactive:
+            import keyboard
+
+            with self.input_turn(), span("input:key"):
+                if self.timing.key_press_duration:
+                    keyboard.press(key)
+                    time.sleep(self.timing.key_press_duration)
+                    keyboard.release(key)
+                else:
+                    keyboard.press_and_release(key)
+        self.last_input_time = time.time()
+
+
+class Backoff:
+    """
+    Spaces out attempts at something slow that keeps failing (i.e. searching the whole desktop for a window that
+    isn't open). The next attempt is allowed `interval` seconds after the last failed one *finished*, and every
+    failure doubles the interval, up to `maximum`. A success starts over from `initial`.
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 30.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.interval = initial
+        self.next_attempt = 0.0
+
+    def ready(self) -> bool:
+        return time.time() >= self.next_attempt
+
+    def failed(self) -> None:
+        self.next_attempt = time.time() + self.interval
+        self.interval = min(self.interval * 2, self.maximum)
+
+    def succeeded(self) -> None:
+        self.interval = self.initial
+        self.next_attempt = 0.0
+
 
-    def drag(self, x1: float | int, y1: float | int, x2: float | int, y2: float | int) -> None:
-        _op = self.move(x1, y1)
-        mouse.press()
-        time.sleep(0.05)
-        self.move(x2, y2)
-        time.sleep(0.01)
-        mouse.release()
-        self.move(*_op)
+class Tracker:
+    """
+    Remembers where each anchor template was last found on the screen, so that it can be found again by only
+    looking at a small region around that spot. The search only grows (roi -> window -> monitor -> desktop)
+    when the template can't be found with a difference of at most `max_difference`.
+
+    The "window" stage covers everywhere a game window of `window_size` (at a UI `scale` of 1) could be while still
+    containing the template's last location, so owners should keep `scale` up to date when it is detected.
+    """
+
+    def __init__(
+        self,
+        da: DesktopAutomator,
+        max_difference: float = 0.01,
+        padding: int = 20,
+        window_size: tuple[int, int] = (1280, 720),
+        pyramid: int = 4,
+        scale: float = 1.0,
+    ):
+        self.da = da
+        self.max_difference = max_difference
+        self.padding = padding
+        self.window_size = window_size
+        self.pyramid = pyramid
+        self.scale = scale
+
+        self.locations: dict[str, tuple[int, int]] = {}  # template name -> screen x, y
+
+    @staticmethod
+    def key(template: PreparedTemplate) -> str:
+        return template.name or str(id(template))
+
+    def clip(self, region: dict[str, int]) -> dict[str, int]:
+        desktop = self.da.source.monitors[0]
+        left, top = max(region["left"], desktop["left"]), max(region["top"], desktop["top"])
+        right = min(region["left"] + region["width"], desktop["left"] + desktop["width"])
+        bottom = min(region["top"] + region["height"], desktop["top"] + desktop["height"])
+        return {"left": left, "top": top, "width": max(0, right - left), "height": max(0, bottom - top)}
+
+    def search_regions(self, template: PreparedTemplate) -> list[tuple[str, dict[str, int]]]:
+        regions = []
+
+        location = self.locations.get(self.key(template))
+        if location is not None:
+            x, y = location
+            window_width, window_height = (round(size * self.scale) for size in self.window_size)
+            window_padding = (
+                max(self.padding, window_width - template.width),
+                max(self.padding, window_height - template.height),
+            )
+            for stage, (pad_x, pad_y) in (("roi", (self.padding,) * 2), ("window", window_padding)):
+                region = {
+                    "left": x - pad_x,
+                    "top": y - pad_y,
+                    "width": template.width + pad_x * 2,
+                    "height": template.height + pad_y * 2,
+                }
+                regions.append((stage, self.clip(region)))
+
+            for monitor in self.da.source.monitors[1:]:
+                if (
+                    monitor["left"] <= x < monitor["left"] + monitor["width"]
+                    and monitor["top"] <= y < monitor["top"] + monitor["height"]
+                ):
+                    regions.append(("monitor", self.clip(monitor)))
+                    break
+
+        regions.append(("desktop", self.da.source.monitors[0]))
+
+        # skip any stage that wouldn't look at anything new
+        unique_regions = []
+        for stage, region in regions:
+            if region["width"] < template.width or region["height"] < template.height:
+                continue
+            if unique_regions and unique_regions[-1][1] == region:
+                continue
+            unique_regions.append((stage, region))
+
+        return unique_regions
+
+    def locate(self, template: PreparedTemplate) -> tuple[int, int, float]:
+        """
+        Returns the screen position of `template` and its difference, just like `DesktopAutomator.find_in_image`.
+        If the difference is above `max_difference`, the template was not found and its location is forgotten.
+        """
+        best = None
+        for stage, region in self.search_regions(template):
+            image = self.da.grab_monitor(region)
+
+            # only the small roi is cheap enough to search exhaustively
+            pyramid = 1 if stage == "roi" else self.pyramid
+            x, y, difference = self.da.find_in_image(image, template, pyramid=pyramid)
+            x, y = x + region["left"], y + region["top"]
+
+            if best is None or difference < best[2]:
+                best = x, y, difference
+
+            if difference <= self.max_difference:
+                self.remember(template, x, y)
+                return x, y, difference
+
+        self.forget(template)
+
+        assert best is not None
+        return best
+
+    def roi(self, template: PreparedTemplate, padding: int | None = None) -> tuple[int, int, int, int] | None:
+        """
+        The (x, y, width, height) of a padded region around where `template` was last found, if it was.
+        """
+        location = self.locations.get(self.key(template))
+        if location is None:
+            return None
+
+        padding = self.padding if padding is None else padding
+        x, y = location
+        return x - padding, y - padding, template.width + padding * 2, template.height + padding * 2
+
+    def remember(self, template: PreparedTemplate, x: int, y: int) -> None:
+        """
+        Records a location that was found some other way, so the next `locate` starts looking there.
+        """
+        self.locations[self.key(template)] = x, y
+
+    def forget(self, template: PreparedTemplate | None = None) -> None:
+        if template is None:
+            self.locations.clear()
+        else:
+            self.locations.pop(self.key(template), None)
+
+
+class ResourcePack:
+    """
+    Every template image in one file, laid out so that it can be memory mapped instead of decoded.
+    Processes that map the same pack share its pages, so they don't each hold their own copy of the images.
+
+    The file starts with an 8 byte little endian length, followed by a JSON index of that length, followed by
+    the raw pixels of each image.
+    """
+
+    alignment = 64
+
+    def __init__(self, path: str | pathlib.Path):
+        self.path = pathlib.Path(path)
+        with open(self.path, "rb") as f:
+            header_length = int.from_bytes(f.read(8), "little")
+            self.index: dict[str, dict] = json.loads(f.read(header_length))
+
+        self.data = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def image(self, name: str) -> np.ndarray:
+        entry = self.index[name]
+        dtype = np.dtype(entry["dtype"])
+        size = int(np.prod(entry["shape"])) * dtype.itemsize
+        pixels = self.data[entry["offset"] : entry["offset"] + size]
+        return np.asarray(pixels).view(dtype).reshape(entry["shape"])
+
+    @classmethod
+    def write(cls, path: str | pathlib.Path, images: dict[str, np.ndarray]) -> None:
+        index, offset = {}, 0
+        for name, image in images.items():
+            index[name] = {"offset": offset, "shape": list(image.shape), "dtype": image.dtype.str}
+            offset += -(-image.nbytes // cls.alignment) * cls.alignment
+
+        # the offsets above are relative to the pixels, but shifting them can make the header itself longer
+        start = 0
+        while True:
+            shifted = {name: {**entry, "offset": entry["offset"] + start} for name, entry in index.items()}
+            header = json.dumps(shifted).encode()
+            needed = -(-(8 + len(header)) // cls.alignment) * cls.alignment
+            if needed <= start:
+                break
+            start = needed
+
+        index = shifted
+        header = header.ljust(start - 8)
+
+        with open(path, "wb") as f:
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for name, image in images.items():
+                f.seek(index[name]["offset"])
+                f.write(np.ascontiguousarray(image).tobytes())
+
+
+class ResourceRegistry:
+    """
+    Loads each bundled resource at most once per process, and only when it is first needed.
+    Everything it returns is shared, so images are read only.
+
+    If `resource/templates.pack` exists (see `pack_resources`) and is newer than every PNG, images are memory
+    mapped from it instead of decoded.
+    """
+
+    def __init__(self, root: pathlib.Path = file_root / "resource"):
+        self.root = root
+        self.pack_path = root / "templates.pack"
+        self.lock = threading.RLock()
+
+        self.images: dict[str, np.ndarray] = {}
+        self.templates: dict[str, PreparedTemplate] = {}
+        self.fonts: dict[tuple[str, int], "ImageFont.FreeTypeFont"] = {}
+        self.classifiers: dict[tuple, TemplateClassifier | SignatureClassifier] = {}
+        self._pack: ResourcePack | None | bool = False  # False means "haven't looked yet"
+
+    @property
+    def pack(self) -> ResourcePack | None:
+        if self._pack is False:
+            self._pack = None
+            if self.pack_path.exists():
+                packed_at = self.pack_path.stat().st_mtime
+                if all(png.stat().st_mtime <= packed_at for png in self.root.glob("*.png")):
+                    self._pack = ResourcePack(self.pack_path)
+
+        return self._pack  # type: ignore
+
+    def read(self, name: str) -> np.ndarray:
+        """
+        Decodes the image file `name` from disk, skipping the cache and the pack.
+        """
+        image = cv2.imread(str(self.root / name), cv2.IMREAD_UNCHANGED)
+        if image is None:  # cv2 doesn't raise for files that are missing or aren't images
+            raise FileNotFoundError(name)
+        return image
+
+    def image(self, name: str) -> np.ndarray:
+        with self.lock:
+            if name not in self.images:
+                pack = self.pack
+                if pack is not None and name in pack:
+                    image = pack.image(name)
+                else:
+                    image = self.read(name)
+                    image.setflags(write=False)
+                self.images[name] = image
+
+            return self.images[name]
+
+    def template(self, name: str, scale: float = 1.0) -> PreparedTemplate:
+        with self.lock:
+            if name not in self.templates:
+                self.templates[name] = PreparedTemplate(self.image(name), name=name)
+
+            return self.templates[name].rescaled(scale)
+
+    def font(self, name: str, size: int) -> "ImageFont.FreeTypeFont":
+        with self.lock:
+            if (name, size) not in self.fonts:
+                from PIL import ImageFont
+
+                self.fonts[(name, size)] = ImageFont.truetype(str(self.root / name), size)
+
+            return self.fonts[(name, size)]
+
+    @staticmethod
+    def classifier_key(kind: type, templates: dict[str, PreparedTemplate]) -> tuple:
+        return (kind, *((label, template.name) for label, template in templates.items()))
+
+    def template_classifier(self, templates: dict[str, PreparedTemplate]) -> TemplateClassifier:
+        """
+        A shared `TemplateClassifier` for templates that came from this registry.
+        """
+        key = self.classifier_key(TemplateClassifier, templates)
+        with self.lock:
+            classifier = self.classifiers.get(key)
+            if not isinstance(classifier, TemplateClassifier):
+                classifier = self.classifiers[key] = TemplateClassifier(templates)
+
+            return classifier
+
+    def signature_classifier(self, templates: dict[str, PreparedTemplate]) -> SignatureClassifier:
+        """
+        A shared `SignatureClassifier` for templates that came from this registry.
+        """
+        key = self.classifier_key(SignatureClassifier, templates)
+        with self.lock:
+            classifier = self.classifiers.get(key)
+            if not isinstance(classifier, SignatureClassifier):
+                classifier = self.classifiers[key] = SignatureClassifier(templates)
+
+            return classifier
+
+    def preload(self, *names: str, pyramids: tuple[int, ...] = (4,)) -> None:
+        """
+        Prepares the given templates (all of them by default) and their shrunk pyramid copies ahead of time.
+        """
+        for name in names or sorted(png.name for png in self.root.glob("*.png")):
+            template = self.template(name)
+            for factor in pyramids:
+                template.downscaled(factor)
+
+    def write_pack(self) -> pathlib.Path:
+        images = {png.name: self.read(png.name) for png in sorted(self.root.glob("*.png"))}
+        ResourcePack.write(self.pack_path, images)
+
+        with self.lock:
+            self._pack = False
+        return self.pack_path
+
+
+resources = ResourceRegistry()
 
 
 def img_resource(name: str) -> np.ndarray:
-    fpath = str(file_root / "resource" / name)
-    return cv2.imread(fpath, cv2.IMREAD_UNCHANGED)
+    return resources.image(name)
 
 
-def font_resource(name: str, size: int) -> ImageFont.FreeTypeFont:
-    fpath = str(file_root / "resource" / name)
-    return ImageFont.truetype(fpath, size)
+def template_resource(name: str, scale: float = 1.0) -> PreparedTemplate:
+    return resources.template(name, scale)
+
+
+def font_resource(name: str, size: int) -> "ImageFont.FreeTypeFont":
+    return resources.font(name, size)
+
+
+def pack_resources() -> pathlib.Path:
+    """
+    Packs every bundled template into `resource/templates.pack`, so that later processes can memory map them.
+    """
+    return resources.write_pack()
 
 
 def database_resource(name: str) -> sqlite3.Connection: